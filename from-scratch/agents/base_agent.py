@@ -1,15 +1,41 @@
 import abc
 import time
+import random
 import logging
 import asyncio
-from utils.logger import setup_logger
+from utils.logger import setup_logger, agent_task_latency
+from utils.config import config
+from utils.metrics import LatencyHistogram
+from utils.executors import CPU, INLINE, IO, get_background_loop, get_executor
+
+def _process_in_worker(agent, data):
+    # Runs in a CPU pool worker on a pickled copy of the agent; counter deltas are sent back
+    before = {k: v for k, v in agent.metrics.items() if isinstance(v, (int, float))}
+    result = agent.process(data)
+    return result, {k: agent.metrics[k] - v for k, v in before.items()}
 
 class BaseAgent(abc.ABC):
+    # Where aprocess runs: CPU (shared process pool), IO (shared thread pool) or INLINE (on the loop)
+    execution_class = IO
+
     def __init__(self, name):
         self.name = name
         self.logger = setup_logger(name)
         self._state = {}  # state management
-        self.metrics = {"total_duration": 0, "num_tasks": 0}  # performance metrics
+        # performance metrics; "latency" holds one constant-memory histogram per outcome
+        self.metrics = {"total_duration": 0, "num_tasks": 0, "latency": {}}
+
+    # Pickling support for CPU pool workers: loggers and latency histograms stay in the parent
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("logger", None)
+        state["metrics"] = {k: v for k, v in self.metrics.items() if k != "latency"}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.metrics.setdefault("latency", {})
+        self.logger = setup_logger(self.name)
 
     # State getter/setter
     @property
@@ -38,29 +64,61 @@ class BaseAgent(abc.ABC):
         else:
             return "GenericError"
 
-    # Synchronous retry mechanism with exponential backoff
-    def _retry(self, func, *args, retries=3, backoff=1, **kwargs):
+    # Jittered exponential backoff: spreads out retries from agents that failed together
+    def _backoff_delay(self, attempt, backoff):
+        return backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+    def _remaining(self, deadline):
+        return None if deadline is None else deadline - time.monotonic()
+
+    # Coroutine functions run on the shared background loop, anything else on the I/O pool
+    def _submit(self, func, *args, **kwargs):
+        if asyncio.iscoroutinefunction(func):
+            return asyncio.run_coroutine_threadsafe(func(*args, **kwargs), get_background_loop())
+        return get_executor(IO).submit(func, *args, **kwargs)
+
+    # Synchronous retry mechanism; every attempt runs on a worker future bounded by the deadline
+    def _retry(self, func, *args, retries=3, backoff=1, deadline=None, **kwargs):
         attempt = 0
         while attempt < retries:
+            future = self._submit(func, *args, **kwargs)
             try:
-                return func(*args, **kwargs)
+                return future.result(timeout=self._remaining(deadline))
             except Exception as e:
+                if isinstance(e, TimeoutError):
+                    # Cancels a coroutine attempt; a pool thread already running cannot be killed
+                    # and is abandoned, but never blocks the caller past the deadline.
+                    future.cancel()
                 self.logger.error(f"Attempt {attempt+1} failed with error: {self._classify_error(e)}")
-                time.sleep(backoff * (2 ** attempt))
                 attempt += 1
+                if attempt >= retries:
+                    break
+                delay = self._backoff_delay(attempt - 1, backoff)
+                remaining = self._remaining(deadline)
+                if remaining is not None and delay >= remaining:
+                    self.logger.error("Retry budget exhausted by the remaining deadline.")
+                    break
+                time.sleep(delay)
         self.logger.error("All retry attempts failed.")
         return None
 
-    # Asynchronous retry mechanism with exponential backoff
-    async def _retry_async(self, coro, *args, retries=3, backoff=1, **kwargs):
+    # Asynchronous retry mechanism; each attempt is bounded by asyncio.wait_for on the remaining deadline
+    async def _retry_async(self, coro, *args, retries=3, backoff=1, deadline=None, **kwargs):
         attempt = 0
         while attempt < retries:
             try:
-                return await coro(*args, **kwargs)
+                return await asyncio.wait_for(coro(*args, **kwargs), timeout=self._remaining(deadline))
             except Exception as e:
                 self.logger.error(f"Attempt {attempt+1} failed with error: {self._classify_error(e)}")
-                await asyncio.sleep(backoff * (2 ** attempt))
                 attempt += 1
+                if attempt >= retries:
+                    break
+                delay = self._backoff_delay(attempt - 1, backoff)
+                remaining = self._remaining(deadline)
+                if remaining is not None and delay >= remaining:
+                    self.logger.error("Retry budget exhausted by the remaining deadline.")
+                    break
+                await asyncio.sleep(delay)
         self.logger.error("All async retry attempts failed.")
         return None
 
@@ -69,19 +127,62 @@ class BaseAgent(abc.ABC):
         """Processes input data and returns results."""
         pass
 
+    # Latency is recorded per outcome locally and exported as a Prometheus histogram
+    def _record_latency(self, duration, result, deadline):
+        if result is not None:
+            outcome = "success"
+        elif deadline is not None and time.monotonic() >= deadline:
+            outcome = "timeout"
+        else:
+            outcome = "failure"
+        self.metrics["total_duration"] += duration
+        self.metrics["num_tasks"] += 1
+        self.metrics["latency"].setdefault(outcome, LatencyHistogram()).record(duration)
+        agent_task_latency.labels(agent=self.name, outcome=outcome).observe(duration)
+
+    def latency_percentiles(self, outcome="success"):
+        """Count, mean and p50/p95/p99 latency in seconds for tasks with the given outcome."""
+        histogram = self.metrics["latency"].get(outcome)
+        return histogram.summary() if histogram else LatencyHistogram().summary()
+
     # Async version of process
     async def aprocess(self, data):
-        """Asynchronously processes input data and returns results."""
-        return await asyncio.get_event_loop().run_in_executor(None, self.process, data)
+        """Asynchronously processes input data on the pool matching the agent's execution class."""
+        if asyncio.iscoroutinefunction(self.process):
+            return await self.process(data)
+        if self.execution_class == INLINE:
+            return self.process(data)
+        loop = asyncio.get_running_loop()
+        if self.execution_class == CPU:
+            executor = get_executor(CPU)
+            if executor is not None:
+                result, deltas = await loop.run_in_executor(executor, _process_in_worker, self, data)
+                for key, delta in deltas.items():
+                    self.metrics[key] += delta
+                return result
+        return await loop.run_in_executor(get_executor(IO), self.process, data)
+
+    # Runs process() to completion; coroutine implementations get a private event loop on the worker thread
+    def _process_sync(self, data):
+        result = self.process(data)
+        if asyncio.iscoroutine(result):
+            return asyncio.run(result)
+        return result
+
+    def _deadline(self, timeout):
+        timeout = config.get("timeout") if timeout is None else timeout
+        return time.monotonic() + timeout if timeout else None
 
-    # Modified synchronous execute with input validation, retry, metrics, and output validation
-    def execute(self, data, timeout=10, retries=3, backoff=1):
+    # Modified synchronous execute with input validation, retry, deadline, metrics, and output validation
+    def execute(self, data, timeout=None, retries=3, backoff=1):
+        """Runs process() with retries; timeout (seconds, default config timeout, 0 = none) bounds all attempts."""
         self.validate_input(data)
         start_time = time.time()
-        result = self._retry(self.process, data, retries=retries, backoff=backoff)
+        deadline = self._deadline(timeout)
+        process = self.process if asyncio.iscoroutinefunction(self.process) else self._process_sync
+        result = self._retry(process, data, retries=retries, backoff=backoff, deadline=deadline)
         duration = time.time() - start_time
-        self.metrics["total_duration"] += duration
-        self.metrics["num_tasks"] += 1
+        self._record_latency(duration, result, deadline)
         try:
             self.validate_output(result)
         except Exception as e:
@@ -89,14 +190,15 @@ class BaseAgent(abc.ABC):
         self.logger.info(f"{self.name} completed task in {duration:.2f} sec")
         return result
 
-    # Async execute using the async retry mechanism
-    async def aexecute(self, data, timeout=10, retries=3, backoff=1):
+    # Async execute using the async retry mechanism and deadline propagation
+    async def aexecute(self, data, timeout=None, retries=3, backoff=1):
+        """Async counterpart of execute(); the deadline is enforced with asyncio.wait_for."""
         self.validate_input(data)
         start_time = time.time()
-        result = await self._retry_async(self.aprocess, data, retries=retries, backoff=backoff)
+        deadline = self._deadline(timeout)
+        result = await self._retry_async(self.aprocess, data, retries=retries, backoff=backoff, deadline=deadline)
         duration = time.time() - start_time
-        self.metrics["total_duration"] += duration
-        self.metrics["num_tasks"] += 1
+        self._record_latency(duration, result, deadline)
         try:
             self.validate_output(result)
         except Exception as e:
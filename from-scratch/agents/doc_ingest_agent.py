@@ -1,119 +1,279 @@
 import os
+import asyncio
+import hashlib
 import mimetypes
-import docx
+from collections import deque
 import PyPDF2
-from bs4 import BeautifulSoup  # for HTML parsing
+import ebooklib
 from ebooklib import epub    # for EPUB parsing
 from .base_agent import BaseAgent
+from utils.config import config
+from utils.cache import DiskCache
+from utils.text_extractors import HTMLTextExtractor, html_to_text, iter_docx_text
+from utils.executors import CPU, IO, get_executor
+
+def _extract_pdf_pages(file_path, start, stop):
+    # Runs in a worker process; every worker opens the file independently
+    with open(file_path, "rb") as pdf_file:
+        reader = PyPDF2.PdfReader(pdf_file)
+        return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+def _extract_chapter_text(content):
+    # Runs in a worker process on the raw XHTML bytes of one EPUB chapter
+    return html_to_text(content.decode("utf-8", errors="replace"))
 
 class DocumentIngestionAgent(BaseAgent):
+    execution_class = CPU  # parsing is CPU-bound pure Python
     CHUNK_SIZE = 1024 * 1024  # 1 MB chunks
+    PARALLEL_PDF_MIN_PAGES = 16  # smaller PDFs are not worth the process start-up cost
+    PDF_PAGES_PER_TASK = 8
+    PARALLEL_EPUB_MIN_CHAPTERS = 4
+    EXTRACTOR_VERSION = 4  # bump whenever extraction output changes to invalidate cached entries
 
-    def __init__(self):
+    def __init__(self, workers=None, cache=None):
         super().__init__("DocumentIngestionAgent")
+        # page-level PDF / chapter-level EPUB parallelism on the shared CPU pool (1 disables)
+        self.workers = workers if workers is not None else config.get("cpu_workers")
+        if cache is None and config.get("ingest_cache_path"):
+            cache = DiskCache(config.get("ingest_cache_path"), config.get("ingest_cache_max_bytes"))
+        self.cache = cache or None  # cache=False disables caching explicitly
+        self.metrics.update({"cache_hits": 0, "cache_misses": 0})
 
     def _detect_mime_type(self, file_path):
         mime, _ = mimetypes.guess_type(file_path)
         return mime
 
     def _validate_file(self, file_path):
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"File {file_path} not found.")
         if os.path.getsize(file_path) == 0:
             raise ValueError(f"File {file_path} is empty or corrupted.")
         return True
 
-    def _extract_text_from_txt(self, file_path):
-        text = ""
+    def _content_digest(self, file_path):
+        # size+mtime+inode fingerprint lets unchanged files skip re-hashing their content
+        stats = os.stat(file_path)
+        fingerprint = f"stat:{os.path.abspath(file_path)}:{stats.st_size}:{stats.st_mtime_ns}:{stats.st_ino}"
+        digest = self.cache.get(fingerprint)
+        if digest is None:
+            sha = hashlib.sha256()
+            with open(file_path, "rb") as f:
+                for block in iter(lambda: f.read(self.CHUNK_SIZE), b""):
+                    sha.update(block)
+            digest = sha.hexdigest()
+            self.cache.set(fingerprint, digest)
+        return digest
+
+    def _cache_lookup(self, file_path):
+        # Returns (cache_key, cached_entry); both are None when caching is disabled
+        if self.cache is None:
+            return None, None
+        key = f"doc:{self.EXTRACTOR_VERSION}:{self._content_digest(file_path)}"
+        entry = self.cache.get(key)
+        self.metrics["cache_hits" if entry else "cache_misses"] += 1
+        return key, entry
+
+    # Extractors are generators so large documents never need to sit in memory as one string
+    def _iter_text_from_txt(self, file_path):
         file_size = os.path.getsize(file_path)
         processed = 0
         with open(file_path, 'r', encoding='utf-8') as file:
-            while True:
-                chunk = file.read(self.CHUNK_SIZE)
-                if not chunk:
-                    break
-                text += chunk
+            for chunk in iter(lambda: file.read(self.CHUNK_SIZE), ""):
                 processed += len(chunk)
                 self.logger.info(f"Processed {processed/file_size*100:.2f}% of txt file")
-        return text
+                yield chunk
 
-    def _extract_text_from_pdf(self, file_path):
-        text = ""
+    def _iter_text_from_pdf(self, file_path):
         with open(file_path, "rb") as pdf_file:
             reader = PyPDF2.PdfReader(pdf_file)
+            num_pages = len(reader.pages)
+            if self.workers > 1 and num_pages >= self.PARALLEL_PDF_MIN_PAGES:
+                yield from self._iter_pdf_pages_parallel(file_path, num_pages)
+                return
             for i, page in enumerate(reader.pages):
                 page_text = page.extract_text()
                 if page_text:
-                    text += page_text + "\n"
-                self.logger.info(f"Processed page {i+1}/{len(reader.pages)}")
-        return text
+                    yield page_text + "\n"
+                self.logger.info(f"Processed page {i+1}/{num_pages}")
+
+    def _iter_pdf_pages_parallel(self, file_path, num_pages):
+        ranges = (
+            (file_path, start, min(start + self.PDF_PAGES_PER_TASK, num_pages))
+            for start in range(0, num_pages, self.PDF_PAGES_PER_TASK)
+        )
+        for (_, _, stop), pages in self._imap_ordered(_extract_pdf_pages, ranges):
+            for page_text in pages:
+                if page_text:
+                    yield page_text + "\n"
+            self.logger.info(f"Processed page {stop}/{num_pages}")
 
-    def _extract_text_from_docx(self, file_path):
-        doc = docx.Document(file_path)
-        text = "\n".join([para.text for para in doc.paragraphs])
+    def _imap_ordered(self, func, arg_tuples):
+        # Fans calls out to the shared CPU pool and yields (args, result) in submission order.
+        # At most two tasks per worker are in flight so memory stays bounded. Inside a pool
+        # worker (whole-document parsing via aprocess) there is no nested pool: run inline.
+        # aprocess keeps documents that fan out in this process for that reason.
+        pool = get_executor(CPU)
+        if pool is None:
+            for args in arg_tuples:
+                yield args, func(*args)
+            return
+        arg_tuples = iter(arg_tuples)
+        pending = deque()
+        try:
+            while True:
+                while len(pending) < self.workers * 2:
+                    args = next(arg_tuples, None)
+                    if args is None:
+                        break
+                    pending.append((args, pool.submit(func, *args)))
+                if not pending:
+                    break
+                args, future = pending.popleft()
+                yield args, future.result()
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+    def _fans_out(self, file_path):
+        # Whether extraction would split the document across the CPU pool (PDF pages, EPUB chapters)
+        if self.workers <= 1 or get_executor(CPU) is None:
+            return False
+        try:
+            extractor = self._select_extractor(file_path)
+            if extractor == self._iter_text_from_pdf:
+                with open(file_path, "rb") as pdf_file:
+                    return len(PyPDF2.PdfReader(pdf_file).pages) >= self.PARALLEL_PDF_MIN_PAGES
+            return extractor == self._iter_text_from_epub
+        except Exception:
+            return False  # process() reports the error
+
+    async def aprocess(self, file_path):
+        # A pool worker cannot fan out to a nested pool, so documents that split into pages or
+        # chapters are parsed from an IO thread in this process, which hands the pieces to the CPU pool
+        loop = asyncio.get_running_loop()
+        if await loop.run_in_executor(get_executor(IO), self._fans_out, file_path):
+            return await loop.run_in_executor(get_executor(IO), self.process, file_path)
+        return await super().aprocess(file_path)
+
+    def _iter_text_from_docx(self, file_path):
+        yield from iter_docx_text(file_path)
         self.logger.info("Extracted text from docx")
-        return text
 
-    def _extract_text_from_html(self, file_path):
-        text = ""
+    def _iter_text_from_html(self, file_path):
+        # The feed-style parser carries partial tags and entities across chunk boundaries
+        parser = HTMLTextExtractor()
         file_size = os.path.getsize(file_path)
         processed = 0
         with open(file_path, 'r', encoding='utf-8') as file:
             for chunk in iter(lambda: file.read(self.CHUNK_SIZE), ""):
-                soup = BeautifulSoup(chunk, 'html.parser')
-                text += soup.get_text(separator="\n")
+                parser.feed(chunk)
                 processed += len(chunk)
                 self.logger.info(f"Processed {processed/file_size*100:.2f}% of html file")
-        return text
+                yield parser.drain()
+        parser.close()
+        yield parser.drain()
 
-    def _extract_text_from_epub(self, file_path):
-        text = ""
+    def _iter_text_from_epub(self, file_path):
         book = epub.read_epub(file_path)
-        for item in book.get_items():
-            if item.get_type() == epub.EpubHtml:
-                soup = BeautifulSoup(item.get_content(), 'html.parser')
-                text += soup.get_text(separator="\n")
+        # Chapters are read in spine (reading) order; fall back to manifest order without a spine
+        chapters = [book.get_item_with_id(idref) for idref, _ in book.spine]
+        chapters = [item for item in chapters if item is not None and item.get_type() == ebooklib.ITEM_DOCUMENT]
+        if not chapters:
+            chapters = list(book.get_items_of_type(ebooklib.ITEM_DOCUMENT))
+
+        if self.workers > 1 and len(chapters) >= self.PARALLEL_EPUB_MIN_CHAPTERS:
+            texts = (text for _, text in self._imap_ordered(
+                _extract_chapter_text, ((item.get_content(),) for item in chapters)))
+        else:
+            texts = (_extract_chapter_text(item.get_content()) for item in chapters)
+        for i, text in enumerate(texts):
+            self.logger.info(f"Processed chapter {i+1}/{len(chapters)}")
+            yield text + "\n"
         self.logger.info("Extracted text from epub")
-        return text
 
     def _extract_metadata(self, file_path):
         stats = os.stat(file_path)
         return {"file_name": os.path.basename(file_path), "size": stats.st_size, "modified": stats.st_mtime}
 
-    def process(self, file_path):
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"File {file_path} not found.")
-
-        self._validate_file(file_path)
+    def _select_extractor(self, file_path):
         mime = self._detect_mime_type(file_path)
         self.logger.info(f"Detected MIME type: {mime}")
 
         if mime:
             if mime.startswith("text/plain"):
-                extractor = self._extract_text_from_txt
+                return self._iter_text_from_txt
             elif mime == "application/pdf":
-                extractor = self._extract_text_from_pdf
+                return self._iter_text_from_pdf
             elif mime == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-                extractor = self._extract_text_from_docx
+                return self._iter_text_from_docx
             elif mime == "text/html":
-                extractor = self._extract_text_from_html
+                return self._iter_text_from_html
             elif mime == "application/epub+zip":
-                extractor = self._extract_text_from_epub
+                return self._iter_text_from_epub
             else:
                 raise ValueError(f"Unsupported MIME type: {mime}")
-        else:
-            ext = file_path.split(".")[-1].lower()
-            mapping = {
-                "txt": self._extract_text_from_txt,
-                "pdf": self._extract_text_from_pdf,
-                "docx": self._extract_text_from_docx,
-                "html": self._extract_text_from_html,
-                "epub": self._extract_text_from_epub
-            }
-            if ext not in mapping:
-                raise ValueError(f"Unsupported file extension: {ext}")
-            extractor = mapping[ext]
-
-        text = extractor(file_path)
+
+        ext = file_path.split(".")[-1].lower()
+        mapping = {
+            "txt": self._iter_text_from_txt,
+            "pdf": self._iter_text_from_pdf,
+            "docx": self._iter_text_from_docx,
+            "html": self._iter_text_from_html,
+            "epub": self._iter_text_from_epub
+        }
+        if ext not in mapping:
+            raise ValueError(f"Unsupported file extension: {ext}")
+        return mapping[ext]
+
+    def _rechunk(self, pieces):
+        # Coalesce small pieces (pages, paragraphs) and split large ones into CHUNK_SIZE slices
+        buffer, buffered = [], 0
+        for piece in pieces:
+            buffer.append(piece)
+            buffered += len(piece)
+            if buffered >= self.CHUNK_SIZE:
+                text = "".join(buffer)
+                cut = len(text) - len(text) % self.CHUNK_SIZE
+                for start in range(0, cut, self.CHUNK_SIZE):
+                    yield text[start:start + self.CHUNK_SIZE]
+                buffer, buffered = [text[cut:]], len(text) - cut
+        if buffered:
+            yield "".join(buffer)
+
+    def iter_text(self, file_path, use_cache=True):
+        """Stream extracted text as ``(offset, chunk)`` pairs.
+
+        Chunks hold at most ``CHUNK_SIZE`` characters and ``offset`` is the
+        character position of the chunk within the extracted text, so peak
+        memory stays flat regardless of the document size. File validation
+        happens eagerly, before the first chunk is requested. Cached texts are
+        replayed from the cache; misses are streamed without populating it.
+        """
+        self._validate_file(file_path)
+        entry = self._cache_lookup(file_path)[1] if use_cache else None
+        pieces = [entry["text"]] if entry else self._select_extractor(file_path)(file_path)
+
+        def generate():
+            offset = 0
+            for chunk in self._rechunk(pieces):
+                yield offset, chunk
+                offset += len(chunk)
+
+        return generate()
+
+    def process(self, file_path):
+        self._validate_file(file_path)
+        cache_key, entry = self._cache_lookup(file_path)
+        if entry:
+            self.logger.info(f"Extraction cache hit for {file_path}")
+            # stat-derived fields are path specific, so refresh them for the current file
+            return {"text": entry["text"], "metadata": {**entry["metadata"], **self._extract_metadata(file_path)}}
+
+        text = "".join(chunk for _, chunk in self.iter_text(file_path, use_cache=False))
         if not text.strip():
             raise ValueError("Extracted text is empty, possible corruption.")
         metadata = self._extract_metadata(file_path)
-        return {"text": text.strip(), "metadata": metadata}
+        result = {"text": text.strip(), "metadata": metadata}
+        if cache_key:
+            self.cache.set(cache_key, result)
+        return result
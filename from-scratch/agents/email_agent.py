@@ -1,7 +1,9 @@
 import re
 from .base_agent import BaseAgent
+from utils.executors import INLINE
 
 class EmailAgent(BaseAgent):
+    execution_class = INLINE  # string formatting only; not worth a thread hop
     def __init__(self):
         super().__init__("EmailAgent")
         self.signature = "Best Regards,\nBrim AI"  # customizable signature
@@ -1,61 +1,257 @@
 # agents/summarizer_agent.py
-import openai
 import asyncio
+import openai
 import time
 import random
 from .base_agent import BaseAgent
 from utils.openai_config import OpenAIConfig
+from utils.tokenizer import count_tokens, chunk_text
+from utils.cache import DiskCache, MemoryCache, SingleFlight, TieredCache, make_key
+from utils.llm_client import get_async_client, llm_slot
+from utils.rate_limiter import get_rate_limiter
+from utils.model_router import get_model_router
+from utils.cost_ledger import BudgetExceededError, CostLedger, cost_context, price
+from utils.executors import INLINE
 
 class SummarizerAgent(BaseAgent):
-    def __init__(self):
+    execution_class = INLINE  # async network I/O runs on the event loop
+    SYSTEM_PROMPT = "Summarize the following document."
+    MAP_PROMPT = ("Summarize the following section of a longer document. "
+                  "Keep the key facts, figures and names.")
+    REDUCE_PROMPT = "Combine the following partial summaries of one document into a single coherent summary."
+
+    def __init__(self, cache=None, ledger=None):
         super().__init__("SummarizerAgent")
         self.config = OpenAIConfig()
-        self.cache = {}
-        self.client = openai.OpenAI(api_key=self.config.api_key)
-    
-    async def process(self, data):
-        text = data["text"]
-        # Caching mechanism
-        if text in self.cache:
-            return self.cache[text]
-
-        # Define models - primary first, then fallback
-        models = ["gpt-4", "gpt-3.5-turbo"]
-        summary = None
-        cost = None
-        
-        for model in models:
+        self.ledger = ledger or CostLedger(self.config.ledger_path)
+        if cache is None:
+            disk = DiskCache(self.config.cache_path, ttl=self.config.cache_ttl) if self.config.cache_path else None
+            cache = TieredCache(MemoryCache(self.config.cache_max_bytes, self.config.cache_ttl), disk)
+        self.cache = cache
+        self.metrics.update({"cache_hits": 0, "cache_misses": 0, "coalesced": 0})
+        self._single_flight = SingleFlight()  # deduplicates identical in-flight requests
+        self._client = None
+        # Define models - primary first, then fallback; the router skips degraded ones
+        self.models = ["gpt-4", "gpt-3.5-turbo"]
+        self.router = get_model_router(
+            self.models,
+            window=self.config.circuit_window,
+            error_threshold=self.config.circuit_error_threshold,
+            min_calls=self.config.circuit_min_calls,
+            cooldown=self.config.circuit_cooldown,
+        )
+
+    # Async client with a pooled HTTP transport, shared by every agent on the running loop
+    @property
+    def client(self):
+        return self._client or get_async_client(self.config)
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    async def _complete(self, prompt, text):
+        # Cached summarization call; keys digest (models, prompt, whitespace-normalized text)
+        key = make_key(",".join(self.models), prompt, " ".join(text.split()))
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.metrics["cache_hits"] += 1
+            return {"summary": cached["summary"], "tokens": 0, "cost": 0.0}
+
+        async def call():
+            result = await self._call_models(prompt, text)
+            if result:
+                self.cache.set(key, result)
+            return result
+
+        # Identical requests already in flight share that call instead of paying for another one
+        coalesced = self._single_flight.in_flight(key)
+        self.metrics["coalesced" if coalesced else "cache_misses"] += 1
+        result = await self._single_flight.do(key, call)
+        if coalesced and result:
+            return {**result, "tokens": 0, "cost": 0.0}
+        return result
+
+    async def _call_models(self, prompt, text):
+        # One summarization call with adaptive model routing; returns None when every candidate failed
+        estimate = count_tokens(prompt) + count_tokens(text) + self.config.completion_token_estimate
+        for model in self.router.route(estimate, self.config.latency_budget):
+            limiter = get_rate_limiter(model)
             retries = 3
             for attempt in range(retries):
-                try:
-                    response = await self.client.chat.completions.create(
-                        model=model,
-                        messages=[
-                            {"role": "system", "content": "Summarize the following document."},
-                            {"role": "user", "content": text}
-                        ]
-                    )
-                    summary = response.choices[0].message.content
-                    # Token counting and cost tracking (if usage data available)
-                    tokens = response.usage.total_tokens if hasattr(response, 'usage') else 0
-                    cost = tokens * self.config.cost_rate
-                    # Simple summary quality validation: require more than 5 words
-                    if len(summary.split()) < 5:
-                        raise ValueError("Summary quality insufficient")
-                    # Successful summary - break out
+                # Stop spending attempts on a model whose circuit opened meanwhile
+                if not self.router.acquire(model):
+                    self.logger.warning(f"Circuit open for model {model}, skipping")
                     break
+                start_time = None
+                try:
+                    # Queue fairly for the shared RPM/TPM quota instead of failing and backing off blindly
+                    await limiter.acquire(estimate)
+                    async with llm_slot(self.config.max_concurrency):
+                        # The breaker judges endpoint latency, not time spent in our own queues
+                        start_time = time.monotonic()
+                        response = await asyncio.wait_for(
+                            self.client.chat.completions.create(
+                                model=model,
+                                messages=[
+                                    {"role": "system", "content": prompt},
+                                    {"role": "user", "content": text}
+                                ]
+                            ),
+                            timeout=self.config.request_timeout,
+                        )
+                except openai.RateLimitError as e:
+                    # Rejected calls consume no quota and say nothing about endpoint health
+                    self.router.release(model)
+                    limiter.reconcile(estimate, 0)
+                    limiter.pause(self._retry_after(e))
+                    self.logger.warning(f"Model {model} rate limited on attempt {attempt+1}")
+                    continue
                 except Exception as e:
-                    if attempt < retries - 1:
-                        wait_time = random.uniform(1, 3)
-                        await asyncio.sleep(wait_time)
+                    if start_time is None:
+                        self.router.release(model)  # failed before reaching the endpoint
                     else:
-                        self.logger.error(f"Model {model} summarization failed on attempt {attempt+1}: {str(e)}")
-                        summary = None
-            if summary:
-                break
-
-        result = {"summary": summary, "metadata": {**data.get("metadata", {}), "cost": cost}}
-        # Add result to cache
-        if summary:
-            self.cache[text] = result
-        return result
+                        self.router.record(model, False, time.monotonic() - start_time)
+                    self.logger.error(f"Model {model} summarization failed on attempt {attempt+1}: {str(e)}")
+                    if attempt < retries - 1:
+                        await asyncio.sleep(random.uniform(1, 3))
+                    continue
+                except BaseException:
+                    # Cancelled (e.g. a pipeline deadline): free a half-open trial slot so the circuit can close again
+                    self.router.release(model)
+                    raise
+                self.router.record(model, True, time.monotonic() - start_time)
+
+                summary = response.choices[0].message.content
+                # Token counting and cost tracking (if usage data available)
+                prompt_tokens, completion_tokens, cost = self._usage(model, response)
+                tokens = prompt_tokens + completion_tokens
+                limiter.reconcile(estimate, tokens)
+                self.ledger.record(model, prompt_tokens, completion_tokens, cost)
+                # Simple summary quality validation: require more than 5 words
+                if len(summary.split()) < 5:
+                    self.logger.error(f"Model {model} summary quality insufficient on attempt {attempt+1}")
+                    continue
+                return {"summary": summary, "tokens": tokens, "cost": cost}
+        return None
+
+    def _usage(self, model, response):
+        # Prompt/completion tokens priced per model; a bare total falls back to the flat OPENAI_COST_RATE
+        usage = getattr(response, "usage", None)
+        prompt_tokens = getattr(usage, "prompt_tokens", None)
+        completion_tokens = getattr(usage, "completion_tokens", None)
+        if isinstance(prompt_tokens, int) and isinstance(completion_tokens, int):
+            return prompt_tokens, completion_tokens, price(model, prompt_tokens, completion_tokens)
+        total = getattr(usage, "total_tokens", 0)
+        total = total if isinstance(total, int) else 0
+        return total, 0, total * self.config.cost_rate
+
+    def _retry_after(self, error):
+        try:
+            return float(error.response.headers.get("retry-after", self.config.rate_limit_pause))
+        except (AttributeError, TypeError, ValueError):
+            return self.config.rate_limit_pause
+
+    async def _run_stage(self, stage, prompt, texts, stages):
+        # Summarizes texts concurrently (bounded by map_concurrency) and records stage progress/cost
+        semaphore = asyncio.Semaphore(self.config.map_concurrency)
+        start_time = time.time()
+        done = 0
+
+        async def summarize(text):
+            nonlocal done
+            async with semaphore:
+                result = await self._complete(prompt, text)
+            done += 1
+            self.logger.info(f"{stage} stage: {done}/{len(texts)} summaries complete")
+            return result
+
+        results = await asyncio.gather(*(summarize(text) for text in texts))
+        report = {
+            "stage": stage,
+            "calls": len(texts),
+            "tokens": sum(r["tokens"] for r in results if r),
+            "cost": sum(r["cost"] for r in results if r),
+            "duration": time.time() - start_time,
+        }
+        stages.append(report)
+        self.logger.info(f"{stage} stage finished: {report['calls']} calls, {report['tokens']} tokens, "
+                         f"cost {report['cost']:.4f} in {report['duration']:.2f} sec")
+        if not all(results):
+            return None
+        return [r["summary"] for r in results]
+
+    def _pack(self, summaries):
+        # Groups partial summaries so every group fits in a single reduce call
+        groups, current, current_tokens = [], [], 0
+        for summary in summaries:
+            tokens = count_tokens(summary)
+            if current and current_tokens + tokens > self.config.max_input_tokens:
+                groups.append("\n\n".join(current))
+                current, current_tokens = [], 0
+            current.append(summary)
+            current_tokens += tokens
+        if current:
+            groups.append("\n\n".join(current))
+        return groups
+
+    def _project_cost(self, text_tokens, chunks):
+        # Upper-bound estimate from local token counts; each call is priced with the model routing would pick for it
+        completion = self.config.completion_token_estimate
+
+        def call_cost(prompt_tokens):
+            model = (self.router.route(prompt_tokens) or self.models)[0]
+            return price(model, prompt_tokens, completion)
+
+        if chunks is None:
+            return call_cost(count_tokens(self.SYSTEM_PROMPT) + text_tokens)
+        map_prompt = count_tokens(self.MAP_PROMPT)
+        map_cost = sum(call_cost(map_prompt + count_tokens(chunk)) for chunk in chunks)
+        return map_cost + call_cost(count_tokens(self.REDUCE_PROMPT) + len(chunks) * completion)
+
+    async def _map_reduce(self, chunks, stages):
+        self.logger.info(f"Document exceeds {self.config.max_input_tokens} tokens, summarizing {len(chunks)} chunks")
+        summaries = await self._run_stage("map", self.MAP_PROMPT, chunks, stages)
+        level = 0
+        # Reduce recursively until the partial summaries fit into one final call
+        while summaries and len(summaries) > 1:
+            level += 1
+            groups = self._pack(summaries)
+            if len(groups) == len(summaries) and len(groups) > 1:
+                # every partial summary alone fills the context; merge pairwise to guarantee progress
+                groups = ["\n\n".join(summaries[i:i + 2]) for i in range(0, len(summaries), 2)]
+            summaries = await self._run_stage(f"reduce-{level}", self.REDUCE_PROMPT, groups, stages)
+        return summaries[0] if summaries else None
+
+    async def process(self, data):
+        text = data["text"]
+        metadata = dict(data.get("metadata", {}))
+        text_tokens = count_tokens(text)
+        chunks = None
+        if text_tokens > self.config.max_input_tokens:
+            chunks = chunk_text(text, self.config.chunk_tokens, self.config.chunk_overlap)
+
+        # Reject documents over budget before any call is made
+        projected = self._project_cost(text_tokens, chunks)
+        if self.config.max_document_cost and projected > self.config.max_document_cost:
+            raise BudgetExceededError(
+                f"Projected cost {projected:.4f} exceeds budget {self.config.max_document_cost:.4f}")
+
+        document_id = metadata.get("document_id") or make_key(text)[:16]
+        token = cost_context.set({"document_id": document_id, "batch_id": metadata.get("batch_id")})
+        stages = []
+        try:
+            if chunks is None:
+                response = await self._complete(self.SYSTEM_PROMPT, text)
+                summary = response["summary"] if response else None
+                cost = response["cost"] if response else None
+            else:
+                summary = await self._map_reduce(chunks, stages)
+                cost = sum(stage["cost"] for stage in stages)
+        finally:
+            cost_context.reset(token)
+
+        metadata.update({"cost": cost, "projected_cost": projected, "document_id": document_id})
+        if stages:
+            metadata["stages"] = stages
+        return {"summary": summary, "metadata": metadata}
@@ -3,8 +3,11 @@ from agents.doc_ingest_agent import DocumentIngestionAgent
 from agents.summarizer_agent import SummarizerAgent
 from agents.email_agent import EmailAgent
 import asyncio
+from utils.config import config
+from utils.executors import INLINE
 
 class TaskRouterAgent(BaseAgent):
+    execution_class = INLINE  # coordinates the other agents on the event loop
     def __init__(self):
         super().__init__("TaskRouterAgent")
         self.doc_agent = DocumentIngestionAgent()
@@ -13,20 +16,22 @@ class TaskRouterAgent(BaseAgent):
 
     async def process(self, file_path):
         try:
-            # Ingest document
-            doc_result = self.doc_agent.execute(file_path)
+            # Ingest document without blocking the event loop; a hung parse is cut off at the
+            # same per-stage deadline the pipeline uses
+            doc_result = await self.doc_agent.aexecute(file_path, timeout=config.get("ingest_timeout"))
             if not doc_result:
                 self.logger.error("Document ingestion failed.")
                 return None
 
             # Generate summary asynchronously
-            summary_result = await self.summarizer.process(doc_result)
+            summary_result = await asyncio.wait_for(
+                self.summarizer.process(doc_result), config.get("summarize_timeout") or None)
             if not summary_result:
                 self.logger.error("Summarization failed.")
                 return None
 
-            # Merge metadata from ingestion into summary data
-            summary_result["metadata"] = doc_result.get("metadata", {})
+            # Merge metadata from ingestion into summary data, keeping the summarizer's cost fields
+            summary_result["metadata"] = {**doc_result.get("metadata", {}), **summary_result.get("metadata", {})}
 
             # If metadata provides a recipient email, send an email
             recipient = summary_result["metadata"].get("recipient")
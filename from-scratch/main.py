@@ -1,16 +1,39 @@
 import sys
 import asyncio
+import argparse
 from agents.task_router_agent import TaskRouterAgent
+from utils.config import config
+from utils.logger import start_metrics_server
 
-def main():
-    # Sample file path passed as command line argument
-    if len(sys.argv) < 2:
-        print("Usage: python main.py <file_path>")
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest, summarize and draft emails for documents.")
+    parser.add_argument("file_path", nargs="?", help="single document to process")
+    parser.add_argument("--bulk", metavar="SOURCE", help="directory tree or manifest file of documents to process")
+    parser.add_argument("--output", default="results.jsonl", help="JSONL results file for --bulk")
+    parser.add_argument("--journal", help="checkpoint journal for --bulk (default: <output>.journal)")
+    parser.add_argument("--workers", type=int, help="summarization workers for --bulk")
+    parser.add_argument("--timeout", type=float, default=0,
+                        help="deadline in seconds for the whole single-document run (default: 0, none)")
+    args = parser.parse_args(argv)
+    if not args.file_path and not args.bulk:
+        parser.print_usage()
         sys.exit(1)
-    file_path = sys.argv[1]
+    return args
+
+def main():
+    args = parse_args()
+    if config.get("metrics_port"):
+        start_metrics_server(config.get("metrics_port"))
+    if args.bulk:
+        from orchestrator.bulk_ingest import run_bulk
+        stage_workers = {"summarize": args.workers} if args.workers else None
+        totals = asyncio.run(run_bulk(args.bulk, args.output, args.journal, stage_workers=stage_workers))
+        print(f"Processed {totals['ok']} documents ({totals['failed']} failed, {totals['skipped']} skipped) "
+              f"in {totals['elapsed']:.1f}s; results in {args.output}")
+        return
     router = TaskRouterAgent()
     # Using synchronous execute to coordinate tasks
-    result = router.execute(file_path)
+    result = router.execute(args.file_path, timeout=args.timeout)
     print("Task Results:")
     print(result)
 
@@ -0,0 +1,173 @@
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import timedelta
+from typing import Dict, Iterator, Optional, TextIO
+
+SUPPORTED_EXTENSIONS = {".txt", ".pdf", ".docx", ".html", ".epub"}
+
+def iter_input_files(source: str) -> Iterator[str]:
+    """Yield the documents under a directory tree, or listed one per line in a manifest file.
+
+    Directories are walked in sorted order so reruns enumerate files identically.
+    Manifest paths are resolved against the manifest's directory; blank lines and
+    lines starting with ``#`` are ignored.
+    """
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in SUPPORTED_EXTENSIONS:
+                    yield os.path.join(root, name)
+        return
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, "r", encoding="utf-8") as manifest:
+        for line in manifest:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield os.path.join(base, line)
+
+def file_fingerprint(path: str) -> str:
+    """Cheap change detector: a file edited since it was processed is processed again"""
+    stats = os.stat(path)
+    return f"{stats.st_size}:{stats.st_mtime_ns}"
+
+class CheckpointJournal:
+    """Append-only JSONL journal of finished files, so an interrupted run can resume.
+
+    A file is recorded only after its result line has been flushed, so a killed
+    run redoes at most the documents that were in flight. Failed documents are
+    journaled for the record but retried on resume.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.completed: Dict[str, str] = {}  # absolute path -> fingerprint
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # torn final line from a killed run
+                    if entry.get("status") == "ok":
+                        self.completed[entry["path"]] = entry["fingerprint"]
+                    else:
+                        self.completed.pop(entry["path"], None)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def is_done(self, path: str, fingerprint: str) -> bool:
+        """Whether path was processed successfully in its current version"""
+        return self.completed.get(os.path.abspath(path)) == fingerprint
+
+    def mark(self, path: str, fingerprint: str, status: str) -> None:
+        """Journal the outcome for path"""
+        path = os.path.abspath(path)
+        self._file.write(json.dumps({"path": path, "fingerprint": fingerprint, "status": status}) + "\n")
+        self._file.flush()
+        if status == "ok":
+            self.completed[path] = fingerprint
+
+    def close(self) -> None:
+        self._file.close()
+
+class Progress:
+    """Live counters with throughput and ETA for the documents of one run"""
+    def __init__(self, total: int):
+        self.total = total
+        self.ok = 0
+        self.failed = 0
+        self.start = time.time()
+
+    @property
+    def done(self) -> int:
+        return self.ok + self.failed
+
+    def rate(self) -> float:
+        """Documents finished per second"""
+        elapsed = time.time() - self.start
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def render(self) -> str:
+        rate = self.rate()
+        eta = str(timedelta(seconds=int((self.total - self.done) / rate))) if rate else "--:--:--"
+        return f"{self.done}/{self.total} documents ({self.failed} failed) | {rate:.2f} docs/s | ETA {eta}"
+
+def _result_line(record: dict) -> dict:
+    # Full extracted text stays out of the results file; summaries and drafts are kept
+    summary = record.get("summary") or {}
+    return {
+        "file_path": record["file_path"],
+        "status": record["status"],
+        "failed_stage": record["failed_stage"],
+        "error": record["error"],
+        "summary": summary.get("summary"),
+        "metadata": summary.get("metadata") or (record.get("document") or {}).get("metadata"),
+        "email": record.get("email"),
+    }
+
+async def run_bulk(source: str, output: str, journal_path: Optional[str] = None, task_manager=None,
+                   stage_workers: Optional[Dict[str, int]] = None, progress_interval: float = 1.0,
+                   stream: TextIO = sys.stderr) -> dict:
+    """Run every document under source through the staged pipeline, resumably.
+
+    Results are appended to the ``output`` JSONL file one line per document as
+    they finish (on resume, a later line for the same file supersedes an earlier
+    one); ``journal_path`` (default ``<output>.journal``) records finished files
+    so a rerun skips them. Progress is reported to stream every
+    progress_interval seconds. Returns the run totals and per-stage metrics.
+    """
+    if task_manager is None:
+        from orchestrator.task_manager import TaskManager
+        task_manager = TaskManager()
+    journal = CheckpointJournal(journal_path or output + ".journal")
+    fingerprints = {}
+    unreadable = {}  # path -> error, for listed files that are missing or cannot be stat'ed
+    skipped = 0
+    for path in iter_input_files(source):
+        try:
+            fingerprint = file_fingerprint(path)
+        except OSError as e:
+            unreadable[path] = f"{type(e).__name__}: {e}"
+            continue
+        if journal.is_done(path, fingerprint):
+            skipped += 1
+        else:
+            fingerprints[path] = fingerprint
+    progress = Progress(len(fingerprints) + len(unreadable))
+
+    def report():
+        print(f"\r{progress.render()}", end="", file=stream, flush=True)
+
+    async def report_periodically():
+        while True:
+            await asyncio.sleep(progress_interval)
+            report()
+
+    with open(output, "a", encoding="utf-8") as results:
+        def on_result(record):
+            results.write(json.dumps(_result_line(record), default=str) + "\n")
+            results.flush()
+            journal.mark(record["file_path"], fingerprints.get(record["file_path"], ""), record["status"])
+            if record["status"] == "ok":
+                progress.ok += 1
+            else:
+                progress.failed += 1
+
+        if skipped:
+            print(f"Resuming: {skipped} documents already processed", file=stream)
+        for path, error in unreadable.items():
+            on_result({"file_path": path, "priority": 5, "status": "failed", "failed_stage": "ingest", "error": error})
+        reporter = asyncio.create_task(report_periodically())
+        try:
+            stage_metrics = await task_manager.run_pipeline_queue(
+                ((5, path) for path in fingerprints), stage_workers=stage_workers, on_result=on_result)
+        finally:
+            reporter.cancel()
+            journal.close()
+            report()
+            print(file=stream)
+
+    return {"total": progress.total + skipped, "skipped": skipped, "ok": progress.ok,
+            "failed": progress.failed, "elapsed": time.time() - progress.start, "stage_metrics": stage_metrics}
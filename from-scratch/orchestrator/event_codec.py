@@ -0,0 +1,105 @@
+import json
+import struct
+import threading
+import zlib
+from typing import BinaryIO, Iterator
+
+try:
+    import msgpack
+except ImportError:  # optional: fall back to JSON payloads
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # optional: records are stored uncompressed
+    zstandard = None
+
+MAGIC = b"EVQ\x01"  # first bytes of a binary event log; anything else is read as legacy JSON lines
+HEADER = struct.Struct(">IBI")  # payload length, flags, crc32 of the payload
+FLAG_JSON = 1
+FLAG_ZSTD = 2
+COMPRESS_MIN_BYTES = 512  # smaller payloads rarely shrink enough to pay for compression
+
+# Records are positional arrays: [op, event_id, ...op-specific fields]
+OPS = ("publish", "ack", "nack", "dead")
+_OP_CODES = {op: code for code, op in enumerate(OPS)}
+
+_local = threading.local()  # zstd contexts are not safe to share between threads
+
+def _zstd():
+    if not hasattr(_local, "compressor"):
+        _local.compressor = zstandard.ZstdCompressor(level=3)
+        _local.decompressor = zstandard.ZstdDecompressor()
+    return _local.compressor, _local.decompressor
+
+def encode_record(record: dict) -> bytes:
+    """Encode one log record as a length-prefixed, checksummed frame"""
+    op = record.get("op", "publish")
+    fields = [_OP_CODES[op], record["event_id"]]
+    if op == "publish":
+        fields += [record["data"], record["priority"], record["timestamp"]]
+    elif op == "nack":
+        fields += [record["attempts"], record.get("error")]
+    if msgpack is not None:
+        payload, flags = msgpack.packb(fields, use_bin_type=True), 0
+    else:
+        payload, flags = json.dumps(fields, separators=(",", ":")).encode("utf-8"), FLAG_JSON
+    if zstandard is not None and len(payload) >= COMPRESS_MIN_BYTES:
+        compressed = _zstd()[0].compress(payload)
+        if len(compressed) < len(payload):
+            payload, flags = compressed, flags | FLAG_ZSTD
+    return HEADER.pack(len(payload), flags, zlib.crc32(payload)) + payload
+
+def _decode_payload(payload: bytes, flags: int) -> dict:
+    if flags & FLAG_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("event log contains zstd-compressed records but zstandard is not installed")
+        payload = _zstd()[1].decompress(payload)
+    if flags & FLAG_JSON:
+        fields = json.loads(payload)
+    elif msgpack is None:
+        raise RuntimeError("event log contains msgpack records but msgpack is not installed")
+    else:
+        fields = msgpack.unpackb(payload, raw=False)
+    op = OPS[fields[0]]
+    record = {"op": op, "event_id": fields[1]}
+    if op == "publish":
+        record.update(data=fields[2], priority=fields[3], timestamp=fields[4])
+    elif op == "nack":
+        record.update(attempts=fields[2], error=fields[3] if len(fields) > 3 else None)
+    return record
+
+def iter_records(f: BinaryIO) -> Iterator[dict]:
+    """Decode the records of an event log opened in binary mode.
+
+    Binary logs stop at the first torn or corrupt frame, which is what a
+    crash mid-append leaves behind, and leave f positioned at the end of
+    the last intact frame so the caller can truncate the tail. Files
+    without the magic header are legacy events.json logs and are parsed as
+    JSON lines.
+    """
+    if f.read(len(MAGIC)) != MAGIC:
+        f.seek(0)
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn write from a crash mid-append
+        return
+    while True:
+        good_offset = f.tell()
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            f.seek(good_offset)
+            return
+        length, flags, checksum = HEADER.unpack(header)
+        payload = f.read(length)
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            f.seek(good_offset)
+            return
+        yield _decode_payload(payload, flags)
+
+def is_binary_log(path: str) -> bool:
+    """Whether path starts with the binary log header"""
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
@@ -1,78 +1,490 @@
 import heapq
 import json
 import os
+import shutil
 import time
 import asyncio
+import functools
+import inspect
+import itertools
+import threading
+import weakref
+from utils.config import config
+from utils.executors import IO, get_executor
+from utils.group_commit import GroupCommitWriter
+from .event_codec import MAGIC, encode_record, is_binary_log, iter_records
 
+_event_seq = itertools.count()
+
+@functools.total_ordering
 class Event:
-    def __init__(self, event_id, data, priority=5, timestamp=None):
+    """Queued event, ordered by (priority, timestamp, creation sequence) so the heap never ties"""
+    __slots__ = ("event_id", "data", "priority", "timestamp", "attempts", "last_error", "seq")
+
+    def __init__(self, event_id, data, priority=5, timestamp=None, attempts=0):
         self.event_id = event_id
         self.data = data
         self.priority = priority
         self.timestamp = timestamp if timestamp else time.time()
+        self.attempts = attempts  # failed deliveries so far
+        self.last_error = None
+        self.seq = next(_event_seq)
+
+    def __lt__(self, other):
+        if not isinstance(other, Event):
+            return NotImplemented
+        return (self.priority, self.timestamp, self.seq) < (other.priority, other.timestamp, other.seq)
+
+class PermanentEventError(Exception):
+    """Raised by handlers (and for unroutable events) to dead-letter an event without retrying it"""
+
+def make_pipeline_handler(task_manager):
+    """Handler for "pipeline" events: runs data["file_path"] through TaskManager.execute_pipeline"""
+    async def handle(event):
+        result = await task_manager.execute_pipeline(
+            event.data["file_path"], priority=event.priority, batch_id=event.data.get("batch_id"))
+        if result is None:
+            raise RuntimeError(f"Pipeline failed for {event.data['file_path']}")
+        return result
+    return handle
 
 class EventQueue:
-    def __init__(self, persistence_file="events.json"):
+    """Priority event queue persisted as a write-ahead log.
+
+    The persistence file is an append-only log of publish records and ack
+    records for processed events, stored as length-prefixed msgpack frames
+    (see event_codec). Logs from before the binary format are converted on
+    load, keeping a .bak copy; an events.json next to a missing events.log
+    is adopted first. Once acks make up most of the log it is compacted: the pending events are
+    written to a fresh log that atomically replaces the old one, so restart
+    recovery reads roughly the backlog, not the whole history.
+
+    Records go through a group-commit writer: publish() returns a Future that
+    resolves once the event is on disk, and publish_durable() awaits it.
+    flush_interval, batch_size and fsync default to the event_* config values.
+
+    Events are dispatched by data["type"] to handlers added with
+    register_handler(); events without a handler are dead-lettered. A pool of
+    consumers (start_consumers / stop, or replay_events for a one-off drain)
+    pops events in priority order and waits on an asyncio.Event that
+    publish() sets, so idle consumers never poll. publish() may be called
+    from other threads; while consumers run it defers the heap update to
+    their loop.
+
+    Failed events are redelivered after an exponential delay. One timer task
+    serves a heap of due times, however many events are waiting. After
+    max_attempts failures (or a PermanentEventError) an event moves to the
+    dead-letter file, where inspect_dead_letters() and replay_dead_letters()
+    can reach it.
+    """
+    def __init__(self, persistence_file="events.log", compact_threshold=1000,
+                 flush_interval=None, batch_size=None, fsync=None, dead_letter_file=None):
         self.queue = []
         self.dead_letter_queue = []
-        self.metrics = {"processed": 0, "failed": 0, "current_queue_length": 0}
+        self.pending = {}  # event_id -> Event published but not yet acknowledged
+        self._pending_lock = threading.Lock()  # publish() may add to pending from other threads
+        self.metrics = {"processed": 0, "failed": 0, "current_queue_length": 0, "wal_records": 0, "compactions": 0,
+                        "truncated_bytes": 0, "retried": 0, "dead_lettered": 0}
         self.persistence_file = persistence_file
+        self.dead_letter_file = dead_letter_file or os.path.splitext(persistence_file)[0] + ".dlq.json"
+        self.max_attempts = config.get("event_max_attempts")
+        self.retry_delay = config.get("event_retry_delay")
+        self.retry_max_delay = config.get("event_retry_max_delay")
+        self._delayed = []  # heap of (due time, seq, event) awaiting redelivery
+        self._delayed_seq = itertools.count()
+        self._timer = None
+        self._timer_wakeup = None
+        self.compact_threshold = compact_threshold  # minimum log length before compaction is considered
+        self.writer = None
+        self._compaction = None  # Future of a compaction running on the I/O pool
+        self.handlers = {}  # event type -> callable(event), sync or async
+        self._ready = None  # set whenever an event may be available to consumers
+        self._loop = None
+        self._consumers = []
+        self._stopping = False
+        self._in_flight = 0
+        self._open_storage(flush_interval, batch_size, fsync)
+
+    def _open_storage(self, flush_interval, batch_size, fsync):
+        # Storage hook: recover the log and start its writer (SQLiteEventQueue overrides this)
+        legacy_file = os.path.splitext(self.persistence_file)[0] + ".json"
+        if legacy_file != self.persistence_file and os.path.exists(legacy_file) \
+                and not os.path.exists(self.persistence_file):
+            # The log used to be called events.json; load_events converts its contents
+            os.replace(legacy_file, self.persistence_file)
         self.load_events()
-    
+        self.load_dead_letters()
+        self.writer = GroupCommitWriter(
+            self.persistence_file,
+            flush_interval=config.get("event_flush_interval") if flush_interval is None else flush_interval,
+            max_batch=batch_size or config.get("event_batch_size"),
+            fsync=config.get("event_fsync") if fsync is None else fsync,
+        )
+        # Commit whatever is still queued when the queue is collected or the interpreter exits
+        weakref.finalize(self, self.writer.close)
+
     def validate_event(self, event):
         return hasattr(event, "event_id") and event.data is not None
 
+    def register_handler(self, event_type, handler):
+        """Route events whose data["type"] is event_type to handler; returns handler"""
+        self.handlers[event_type] = handler
+        return handler
+
+    def _event_type(self, event):
+        return event.data.get("type") if isinstance(event.data, dict) else None
+
     def publish(self, event):
         if not self.validate_event(event):
             raise ValueError("Invalid event structure")
-        heapq.heappush(self.queue, (event.priority, event.timestamp, event))
-        self.metrics["current_queue_length"] = len(self.queue)
-        self.save_event(event)
+        # The pending entry and its log record appear together, so a compaction snapshot
+        # either holds the event or the record lands in the log swapped in
+        with self._pending_lock:
+            self.pending[event.event_id] = event
+            future = self.save_event(event)
+        if self._loop is not None and not self._on_loop():
+            # Called from another thread while consumers run: the heap is only touched on the loop
+            self._loop.call_soon_threadsafe(self._enqueue, event)
+        else:
+            self._enqueue(event)
+        return future
+
+    def _on_loop(self):
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    async def publish_durable(self, event):
+        """Publish event and wait until its record has been committed to disk"""
+        await asyncio.wrap_future(self.publish(event))
 
     def save_event(self, event):
+        return self._append(self._publish_record(event))
+
+    def ack(self, event):
+        # Processed events are never recovered again; failed ones stay pending until acked
+        if self.pending.pop(event.event_id, None) is None:
+            return
+        self._append({"op": "ack", "event_id": event.event_id})
+        self._maybe_compact()
+
+    def _publish_record(self, event):
+        return {
+            "op": "publish",
+            "event_id": event.event_id,
+            "data": event.data,
+            "priority": event.priority,
+            "timestamp": event.timestamp
+        }
+
+    def _nack_record(self, event):
+        return {"op": "nack", "event_id": event.event_id, "attempts": event.attempts, "error": event.last_error}
+
+    def _take_snapshot(self):
+        # Pending events with their retry state; records submitted from here on go to the new log
+        with self._pending_lock:
+            if self.writer is not None:
+                self.writer.hold()
+            return [(event, event.attempts, event.last_error) for event in self.pending.values()]
+
+    def _snapshot_records(self, snapshot):
+        # Retried events carry their attempt count and last error into the new log
+        for event, attempts, last_error in snapshot:
+            yield self._publish_record(event)
+            if attempts:
+                yield {"op": "nack", "event_id": event.event_id, "attempts": attempts, "error": last_error}
+
+    def _enqueue(self, event):
+        heapq.heappush(self.queue, event)
+        self.metrics["current_queue_length"] = len(self.queue)
+        if self._ready is not None:
+            self._wake_consumer()
+
+    def _append(self, record):
+        future = self.writer.submit(encode_record(record))
+        future.add_done_callback(self._report_write_error)
+        self.metrics["wal_records"] += 1
+        return future
+
+    def _report_write_error(self, future):
+        if future.exception() is not None:
+            print(f"Error persisting event: {future.exception()}")
+
+    def _maybe_compact(self):
+        records = self.metrics["wal_records"]
+        if self._compaction is not None or records < self.compact_threshold or records <= 2 * len(self.pending):
+            return
         try:
-            with open(self.persistence_file, "a") as f:
-                f.write(json.dumps({
-                    "event_id": event.event_id,
-                    "data": event.data,
-                    "priority": event.priority,
-                    "timestamp": event.timestamp
-                }) + "\n")
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self.compact()
+            return
+        # On a loop only the snapshot is taken inline; encoding, fsync and the swap run on the I/O pool
+        self._compaction = get_executor(IO).submit(self._write_snapshot, self._take_snapshot())
+        self._compaction.add_done_callback(self._compaction_done)
+
+    def _compaction_done(self, future):
+        self._compaction = None
+
+    def _wait_for_compaction(self, timeout=None):
+        compaction = self._compaction
+        if compaction is not None:
+            compaction.exception(timeout)
+
+    def compact(self):
+        """Rewrite the log as a snapshot of the pending events and atomically swap it in"""
+        self._wait_for_compaction()
+        self._write_snapshot(self._take_snapshot())
+
+    def _write_snapshot(self, snapshot):
+        tmp_file = self.persistence_file + ".compact"
+        records = None
+        try:
+            with open(tmp_file, "wb") as f:
+                f.write(MAGIC)
+                records = [encode_record(record) for record in self._snapshot_records(snapshot)]
+                f.writelines(records)
+                f.flush()
+                os.fsync(f.fileno())
+            # Records submitted before the snapshot commit to the old log first; held ones land in the new log
+            replace = lambda: os.replace(tmp_file, self.persistence_file)
+            if self.writer is None:
+                replace()
+            else:
+                self.writer.swap(replace)
+            self.metrics["compactions"] += 1
         except Exception as e:
-            print(f"Error persisting event: {e}")
+            print(f"Error compacting event log: {e}")
+            records = None
+        finally:
+            held = self.writer.release() if self.writer is not None else 0
+        if records is not None:
+            self.metrics["wal_records"] = len(records) + held
 
     def load_events(self):
         if os.path.exists(self.persistence_file):
             try:
-                with open(self.persistence_file, "r") as f:
-                    for line in f:
-                        evt = json.loads(line.strip())
-                        event = Event(evt["event_id"], evt["data"], evt.get("priority", 5), evt.get("timestamp"))
-                        heapq.heappush(self.queue, (event.priority, event.timestamp, event))
+                records = 0
+                legacy = os.path.getsize(self.persistence_file) > 0 and not is_binary_log(self.persistence_file)
+                with open(self.persistence_file, "rb") as f:
+                    for evt in iter_records(f):
+                        records += 1
+                        # Lines without "op" come from the original events.json format: publishes
+                        op = evt.get("op", "publish")
+                        if op == "publish":
+                            self.pending[evt["event_id"]] = Event(
+                                evt["event_id"], evt["data"], evt.get("priority", 5), evt.get("timestamp"))
+                        elif op == "nack":
+                            event = self.pending.get(evt["event_id"])
+                            if event is not None:
+                                event.attempts, event.last_error = evt["attempts"], evt.get("error")
+                        else:
+                            self.pending.pop(evt["event_id"], None)
+                    good_offset = f.tell()
+                size = os.path.getsize(self.persistence_file)
+                if not legacy and 0 < good_offset < size:
+                    # Cut a torn tail off so new appends are not hidden behind it on the next load
+                    with open(self.persistence_file, "r+b") as f:
+                        f.truncate(good_offset)
+                        os.fsync(f.fileno())
+                    self.metrics["truncated_bytes"] += size - good_offset
+                self.queue = list(self.pending.values())
+                heapq.heapify(self.queue)
+                self.metrics["wal_records"] = records
                 self.metrics["current_queue_length"] = len(self.queue)
+                if legacy:
+                    # Migrate a JSON-lines events.json log to the binary format
+                    shutil.copy2(self.persistence_file, self.persistence_file + ".bak")
+                snapshot = sum(2 if event.attempts else 1 for event in self.pending.values())
+                if legacy or records > snapshot:
+                    # Drop acknowledged history now so the next start only reads the backlog
+                    self.compact()
             except Exception as e:
                 print(f"Error loading persisted events: {e}")
+        if not os.path.exists(self.persistence_file) or os.path.getsize(self.persistence_file) == 0:
+            with open(self.persistence_file, "wb") as f:
+                f.write(MAGIC)
 
-    async def replay_events(self):
-        events = []
-        while self.queue:
-            _, _, event = heapq.heappop(self.queue)
-            events.append(event)
-            await self.process_event(event)
+    def _wake_consumer(self):
+        # Must run on the loop; idle consumers recheck the queue
+        self._ready.set()
+
+    def start_consumers(self, consumers=None, dequeued=None):
+        """Start a pool of consumer tasks on the running loop (default: event_consumers config)"""
+        if self._consumers:
+            raise RuntimeError("consumers are already running")
+        self._loop = asyncio.get_running_loop()
+        self._ready = asyncio.Event()
+        self._stopping = False
+        count = consumers or config.get("event_consumers")
+        self._consumers = [asyncio.create_task(self._consume(dequeued)) for _ in range(count)]
+        self._timer_wakeup = asyncio.Event()
+        self._timer = asyncio.create_task(self._run_timer())
+
+    async def stop(self, timeout=None):
+        """Stop the consumers once the queue is drained.
+
+        Events published while draining are still consumed. After timeout
+        seconds the remaining consumers are cancelled; their in-flight events
+        were never acked and are recovered from the log on restart, as are
+        events still waiting for a delayed redelivery.
+        """
+        if not self._consumers:
+            return
+        self._stopping = True
+        self._ready.set()
+        done, pending = await asyncio.wait(self._consumers, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        self._timer.cancel()
+        await asyncio.gather(*pending, self._timer, return_exceptions=True)
+        self._consumers, self._loop, self._timer = [], None, None
+
+    async def _next_event(self):
+        # Returns None once stopping and drained
+        while not self.queue:
+            if self._stopping:
+                return None
+            self._ready.clear()
+            await self._ready.wait()
+        # No await between the check and the pop, so the pool as a whole dequeues in priority order
+        event = heapq.heappop(self.queue)
         self.metrics["current_queue_length"] = len(self.queue)
+        return event
+
+    async def _consume(self, dequeued):
+        while True:
+            event = await self._next_event()
+            if event is None:
+                return
+            if dequeued is not None:
+                dequeued.append(event)
+            self._in_flight += 1
+            try:
+                await self.process_event(event)
+            finally:
+                self._in_flight -= 1
+
+    async def _run_timer(self):
+        # One task serves every delayed redelivery: sleep until the earliest due time or a new entry
+        while True:
+            self._timer_wakeup.clear()
+            now = time.time()
+            while self._delayed and self._delayed[0][0] <= now:
+                self._enqueue(heapq.heappop(self._delayed)[2])
+            timeout = self._delayed[0][0] - now if self._delayed else None
+            try:
+                await asyncio.wait_for(self._timer_wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _redelivery_delay(self, event):
+        return min(self.retry_delay * 2 ** (event.attempts - 1), self.retry_max_delay)
+
+    def _retry_later(self, event):
+        self._append(self._nack_record(event))
+        heapq.heappush(self._delayed, (time.time() + self._redelivery_delay(event), next(self._delayed_seq), event))
+        self.metrics["retried"] += 1
+        if self._timer_wakeup is not None:
+            self._timer_wakeup.set()
+
+    async def replay_events(self, consumers=None):
+        """Drain the queue with a consumer pool and return the events in dequeue order"""
+        events = []
+        self.start_consumers(consumers, dequeued=events)
+        await self.stop()
         return events
 
     async def process_event(self, event):
         try:
             if not self.validate_event(event):
-                raise ValueError("Event validation failed")
-            await asyncio.sleep(0.1)
+                raise PermanentEventError("Event validation failed")
+            handler = self.handlers.get(self._event_type(event))
+            if handler is None:
+                raise PermanentEventError(f"No handler registered for event type {self._event_type(event)!r}")
+            if inspect.iscoroutinefunction(handler):
+                await handler(event)
+            else:
+                # Synchronous handlers run on the shared I/O pool so consumers keep the loop free
+                await asyncio.get_running_loop().run_in_executor(get_executor(IO), handler, event)
             self.metrics["processed"] += 1
+            self.ack(event)
             print(f"Processed event: {event.event_id}")
         except Exception as e:
-            self.dead_letter_queue.append(event)
             self.metrics["failed"] += 1
+            event.attempts += 1
+            event.last_error = f"{type(e).__name__}: {e}"
             print(f"Failed to process event: {event.event_id}, error: {str(e)}")
+            if isinstance(e, PermanentEventError) or event.attempts >= self.max_attempts:
+                self._dead_letter(event)
+            else:
+                self._retry_later(event)
+
+    def _dead_letter(self, event):
+        # The DLQ file takes ownership of the event; the log forgets it
+        try:
+            with open(self.dead_letter_file, "a") as f:
+                f.write(json.dumps(self._dead_letter_record(event)) + "\n")
+        except Exception as e:
+            print(f"Error persisting dead letter: {e}")
+            return
+        self.dead_letter_queue.append(event)
+        self.metrics["dead_lettered"] += 1
+        if self.pending.pop(event.event_id, None) is not None:
+            self._append({"op": "dead", "event_id": event.event_id})
+            self._maybe_compact()
+
+    def _dead_letter_record(self, event):
+        return {**self._publish_record(event), "op": "dead", "attempts": event.attempts,
+                "error": event.last_error, "failed_at": time.time()}
+
+    def load_dead_letters(self):
+        if os.path.exists(self.dead_letter_file):
+            with open(self.dead_letter_file, "r") as f:
+                for line in f:
+                    try:
+                        evt = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    event = Event(evt["event_id"], evt["data"], evt["priority"], evt["timestamp"], evt["attempts"])
+                    event.last_error = evt.get("error")
+                    self.dead_letter_queue.append(event)
+
+    def inspect_dead_letters(self, event_type=None):
+        """Summaries of dead-lettered events, optionally only those of one event type"""
+        return [
+            {"event_id": event.event_id, "type": self._event_type(event), "priority": event.priority,
+             "attempts": event.attempts, "error": event.last_error}
+            for event in self.dead_letter_queue
+            if event_type is None or self._event_type(event) == event_type
+        ]
+
+    def replay_dead_letters(self, event_ids=None):
+        """Republish dead-lettered events (all, or those in event_ids) with a fresh attempt budget"""
+        selected = [event for event in self.dead_letter_queue if event_ids is None or event.event_id in event_ids]
+        if not selected:
+            return []
+        self.dead_letter_queue = [event for event in self.dead_letter_queue if event not in selected]
+        tmp_file = self.dead_letter_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            for event in self.dead_letter_queue:
+                f.write(json.dumps(self._dead_letter_record(event)) + "\n")
+        os.replace(tmp_file, self.dead_letter_file)
+        for event in selected:
+            event.attempts, event.last_error = 0, None
+            self.publish(event)
+        return selected
+
+    def flush(self, timeout=None):
+        """Block until every record written so far is committed (and a running compaction is done)"""
+        self._wait_for_compaction(timeout)
+        self.writer.flush(timeout)
+
+    def close(self):
+        """Commit queued records and release the log file"""
+        self._wait_for_compaction()
+        self.writer.close()
 
     def get_metrics(self):
-        return self.metrics
+        return {**self.metrics, "in_flight": self._in_flight, "writer": self.writer.stats()}
@@ -0,0 +1,227 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+from concurrent.futures import wait
+from pathlib import Path
+from utils.config import config
+from utils.executors import IO, get_executor
+from .event_queue import Event, EventQueue
+
+class SQLiteEventQueue(EventQueue):
+    """EventQueue stored in a SQLite table instead of an in-memory heap and log.
+
+    Rows move through pending -> leased -> (deleted on ack | delayed | dead).
+    Consumers claim the best pending row inside a BEGIN IMMEDIATE transaction
+    and lease it for lease_seconds, so consumers in several processes can
+    share one database file. A lease that expires (its worker crashed) makes
+    the row pending again, counting as a failed attempt, or dead once that
+    reaches max_attempts. Delayed
+    redeliveries and lease expiries share the available_at column. Nothing
+    is held in memory, so the backlog is bounded by disk, not RAM.
+
+    Publishers in other processes cannot signal this process's consumers,
+    so idle consumers also re-check the table every poll_interval seconds.
+    Statements run on the shared I/O pool because a BEGIN IMMEDIATE can
+    wait on another process's lock; writes resolve their Future once
+    committed and flush() waits for all of them. While a handler runs its
+    lease is renewed every lease_seconds / 3, so only a consumer that
+    stopped heartbeating loses its event.
+    """
+    def __init__(self, path="events.sqlite3", lease_seconds=None, poll_interval=None, fsync=None):
+        self.lease_seconds = lease_seconds or config.get("event_lease_seconds")
+        self.poll_interval = poll_interval or config.get("event_poll_interval")
+        self.owner = uuid.uuid4().hex  # lease owner id of this queue instance
+        super().__init__(persistence_file=path, fsync=fsync)
+
+    def _open_storage(self, flush_interval, batch_size, fsync):
+        self._lock = threading.Lock()
+        self._writes = set()  # submitted writes not yet committed
+        self._writes_lock = threading.Lock()
+        Path(self.persistence_file).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.persistence_file, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Without fsync, commits survive a process crash but not a power loss
+        fsync = config.get("event_fsync") if fsync is None else fsync
+        self._conn.execute(f"PRAGMA synchronous={'FULL' if fsync else 'NORMAL'}")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            "id INTEGER PRIMARY KEY, event_id UNIQUE NOT NULL, data TEXT NOT NULL, "
+            "priority INTEGER NOT NULL, timestamp REAL NOT NULL, status TEXT NOT NULL, "
+            "available_at REAL NOT NULL DEFAULT 0, attempts INTEGER NOT NULL DEFAULT 0, "
+            "lease_owner TEXT, error TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_events_claim ON events (status, priority, timestamp)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_events_available ON events (status, available_at)")
+        weakref.finalize(self, self._conn.close)
+
+    def _row_to_event(self, row):
+        event_id, data, priority, timestamp, attempts, error = row
+        event = Event(event_id, json.loads(data), priority, timestamp, attempts)
+        event.last_error = error
+        return event
+
+    def _write(self, func, *args):
+        # Run one write on the I/O pool; flush() waits for everything submitted so far
+        future = get_executor(IO).submit(func, *args)
+        with self._writes_lock:
+            self._writes.add(future)
+        future.add_done_callback(self._write_done)
+        return future
+
+    def _write_done(self, future):
+        with self._writes_lock:
+            self._writes.discard(future)
+        self._report_write_error(future)
+
+    def publish(self, event):
+        if not self.validate_event(event):
+            raise ValueError("Invalid event structure")
+        return self._write(self._insert, event)
+
+    def _insert(self, event):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO events (event_id, data, priority, timestamp, status, attempts) "
+                "VALUES (?, ?, ?, ?, 'pending', ?)",
+                (event.event_id, json.dumps(event.data), event.priority, event.timestamp, event.attempts),
+            )
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake_consumer)
+
+    def _claim(self):
+        """Atomically lease the highest priority pending event, or return None"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # An expired lease counts as a failed attempt; a poison event that keeps killing its
+                # worker is dead-lettered here, since no handler ever gets to raise for it
+                dead = self._conn.execute(
+                    "UPDATE events SET status = 'dead', lease_owner = NULL, attempts = attempts + 1, "
+                    "error = 'lease expired', available_at = ? "
+                    "WHERE status = 'leased' AND available_at <= ? AND attempts + 1 >= ?",
+                    (now, now, self.max_attempts)).rowcount
+                # Due redeliveries and expired leases become claimable again
+                self._conn.execute(
+                    "UPDATE events SET status = 'pending', lease_owner = NULL, "
+                    "attempts = attempts + (status = 'leased') "
+                    "WHERE status IN ('delayed', 'leased') AND available_at <= ?", (now,))
+                row = self._conn.execute(
+                    "SELECT id, event_id, data, priority, timestamp, attempts, error FROM events "
+                    "WHERE status = 'pending' ORDER BY priority, timestamp, id LIMIT 1").fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE events SET status = 'leased', lease_owner = ?, available_at = ? WHERE id = ?",
+                        (self.owner, now + self.lease_seconds, row[0]))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        self.metrics["dead_lettered"] += dead
+        return self._row_to_event(row[1:]) if row is not None else None
+
+    async def _next_event(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Cleared before claiming, so a publish that lands during the claim is not missed
+            self._ready.clear()
+            event = await loop.run_in_executor(get_executor(IO), self._claim)
+            if event is not None or self._stopping:
+                return event
+            try:
+                await asyncio.wait_for(self._ready.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _update_leased(self, event, sql, *params):
+        # Only the current lease holder may settle an event; a late worker whose lease expired is ignored
+        with self._lock:
+            self._conn.execute(f"{sql} WHERE event_id = ? AND status = 'leased' AND lease_owner = ?",
+                               (*params, event.event_id, self.owner))
+
+    async def process_event(self, event):
+        heartbeat = asyncio.create_task(self._heartbeat(event))
+        try:
+            await super().process_event(event)
+        finally:
+            heartbeat.cancel()
+
+    async def _heartbeat(self, event):
+        # Keep the lease of a slow but healthy handler from expiring under it
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            await loop.run_in_executor(get_executor(IO), self._update_leased, event,
+                                       "UPDATE events SET available_at = ?", time.time() + self.lease_seconds)
+
+    def ack(self, event):
+        self._write(self._update_leased, event, "DELETE FROM events")
+
+    def _retry_later(self, event):
+        self._write(
+            self._update_leased, event,
+            "UPDATE events SET status = 'delayed', lease_owner = NULL, attempts = ?, available_at = ?, error = ?",
+            event.attempts, time.time() + self._redelivery_delay(event), event.last_error)
+        self.metrics["retried"] += 1
+
+    def _dead_letter(self, event):
+        self._write(
+            self._update_leased, event,
+            "UPDATE events SET status = 'dead', lease_owner = NULL, attempts = ?, available_at = ?, error = ?",
+            event.attempts, time.time(), event.last_error)
+        self.metrics["dead_lettered"] += 1
+
+    def inspect_dead_letters(self, event_type=None):
+        self.flush()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT event_id, data, priority, timestamp, attempts, error FROM events "
+                "WHERE status = 'dead' ORDER BY available_at").fetchall()
+        events = [self._row_to_event(row) for row in rows]
+        return [
+            {"event_id": event.event_id, "type": self._event_type(event), "priority": event.priority,
+             "attempts": event.attempts, "error": event.last_error}
+            for event in events
+            if event_type is None or self._event_type(event) == event_type
+        ]
+
+    def replay_dead_letters(self, event_ids=None):
+        self.flush()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT event_id, data, priority, timestamp, attempts, error FROM events "
+                    "WHERE status = 'dead'").fetchall()
+                selected = [self._row_to_event(row) for row in rows if event_ids is None or row[0] in event_ids]
+                self._conn.executemany(
+                    "UPDATE events SET status = 'pending', attempts = 0, error = NULL WHERE event_id = ?",
+                    [(event.event_id,) for event in selected])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if selected and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake_consumer)
+        return selected
+
+    def flush(self, timeout=None):
+        with self._writes_lock:
+            writes = list(self._writes)
+        wait(writes, timeout)
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+    def get_metrics(self):
+        self.flush()
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM events GROUP BY status").fetchall())
+        return {**self.metrics, "current_queue_length": counts.get("pending", 0) + counts.get("delayed", 0),
+                "in_flight": self._in_flight, "statuses": counts}
@@ -1,70 +1,213 @@
 import asyncio
+import inspect
+import itertools
+import math
 import time
+import uuid
 from agents.doc_ingest_agent import DocumentIngestionAgent
 from agents.summarizer_agent import SummarizerAgent
 from agents.email_agent import EmailAgent
+from utils.config import config
+from utils.executors import IO, get_executor
+from utils.logger import pipeline_queue_depth, pipeline_stage_items
+
+STAGES = ("ingest", "summarize", "email")
 
 class TaskManager:
     def __init__(self):
         self.ingestion_agent = DocumentIngestionAgent()
         self.summarizer_agent = SummarizerAgent()
         self.email_agent = EmailAgent()
+        self.stage_metrics = {}
     
-    async def execute_pipeline(self, file_path, priority=5):
+    async def _run_agent(self, agent, data):
+        # Agents dispatch to the pool matching their execution class; plain objects use the I/O pool
+        if hasattr(agent, "aprocess"):
+            return await agent.aprocess(data)
+        return await asyncio.get_running_loop().run_in_executor(get_executor(IO), agent.process, data)
+
+    async def _with_deadline(self, stage, awaitable):
+        # A hung parse or API call fails the document at the stage deadline instead of stalling a worker;
+        # work already running in a pool thread/process is abandoned, coroutines are cancelled
+        timeout = config.get(f"{stage}_timeout")
+        try:
+            return await asyncio.wait_for(awaitable, timeout or None)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"{stage} exceeded its {timeout:g}s deadline") from None
+
+    # Stage handlers: each takes the pipeline item and returns the stage output (falsy on failure)
+    async def _ingest(self, item):
+        # CPU-bound ingestion runs on the shared process pool
+        doc_data = await self._with_deadline("ingest", self._run_agent(self.ingestion_agent, item["file_path"]))
+        if doc_data and item.get("batch_id"):
+            # Lets the cost ledger aggregate LLM spend per batch
+            doc_data["metadata"] = {**doc_data.get("metadata", {}), "batch_id": item["batch_id"]}
+        return doc_data
+
+    async def _summarize(self, item):
+        summary_data = await self._with_deadline("summarize", self.summarizer_agent.process(item["ingest"]))
+        return summary_data if summary_data and summary_data.get("summary") else None
+
+    async def _email(self, item):
+        summary_data = item["summarize"]
+        if not summary_data.get("metadata", {}).get("recipient"):
+            return {"skipped": "no recipient"}
+        # Email drafting is cheap and runs inline
+        return await self._with_deadline("email", self._run_agent(self.email_agent, summary_data))
+
+    async def execute_pipeline(self, file_path, priority=5, batch_id=None):
         start_time = time.time()
+        item = {"file_path": file_path, "priority": priority, "batch_id": batch_id}
         try:
             print("📂 Extracting document...")
-            # Running synchronous ingestion in executor
-            doc_data = await asyncio.get_event_loop().run_in_executor(None, self.ingestion_agent.process, file_path)
-            if not doc_data:
+            item["ingest"] = await self._ingest(item)
+            if not item["ingest"]:
                 # Error recovery: stop if ingestion fails
                 print("❌ Ingestion failed. Skipping pipeline.")
-                return
+                return None
 
             print("📝 Summarizing content...")
-            summary_data = await self.summarizer_agent.process(doc_data)
-            if not summary_data:
+            item["summarize"] = await self._summarize(item)
+            if not item["summarize"]:
                 print("❌ Summarization failed. Skipping pipeline.")
-                return
+                return None
 
             print("📧 Drafting email...")
-            # Running synchronous email drafting in executor
-            email_data = await asyncio.get_event_loop().run_in_executor(None, self.email_agent.process, summary_data)
-            if not email_data:
+            item["email"] = await self._email(item)
+            if not item["email"]:
                 print("❌ Email drafting failed. Skipping pipeline.")
-                return
+                return None
 
             if priority < 5:
                 print("⚡ High priority task processed.")
             
             elapsed = time.time() - start_time
-            print("\n✅ Generated Email:")
-            print(f"Subject: {email_data['subject']}")
-            print(f"Body:\n{email_data['body']}")
+            self._print_email(item["email"])
             print(f"\n⏱ Pipeline executed in {elapsed:.2f} seconds.")
+            return {"document": item["ingest"], "summary": item["summarize"], "email": item["email"]}
 
         except Exception as e:
             print(f"❌ Pipeline execution error: {str(e)}")
+            return None
+
+    def _print_email(self, email_data):
+        if "skipped" in email_data:
+            print(f"\n📭 Email skipped: {email_data['skipped']}")
+            return
+        print("\n✅ Generated Email:")
+        print(f"Subject: {email_data['subject']}")
+        print(f"Body:\n{email_data['body']}")
+
+    def _print_result(self, record):
+        # Default result handler for run_pipeline_queue
+        if record["status"] == "ok":
+            print(f"\n✅ {record['file_path']} (priority {record['priority']}) completed")
+            self._print_email(record["email"])
+        else:
+            print(f"\n❌ {record['file_path']} failed at {record['failed_stage']}: {record['error']}")
+
+    async def run_pipeline_queue(self, tasks, stage_workers=None, on_result=None, queue_size=None):
+        """Run documents through ingest -> summarize -> email as a staged pipeline.
+
+        tasks is an iterable (or async iterable) of (priority, file_path) and is
+        consumed lazily. Every stage has its own worker pool and a bounded
+        priority queue in front of it, so document N+1 is ingested while N is
+        being summarized and a slow stage pushes back on the ones feeding it.
+        on_result(record) (sync or async) receives one record per document; by
+        default results are printed. Returns per-stage metrics.
+        """
+        workers = {
+            "ingest": config.get("ingest_workers"),
+            "summarize": config.get("summarize_workers"),
+            "email": config.get("email_workers"),
+        }
+        workers.update(stage_workers or {})
+        queue_size = queue_size or config.get("stage_queue_size")
+        handlers = {"ingest": self._ingest, "summarize": self._summarize, "email": self._email}
+        queues = {stage: asyncio.PriorityQueue(maxsize=queue_size) for stage in STAGES}
+        self.stage_metrics = {
+            stage: {"workers": workers[stage], "processed": 0, "failed": 0, "busy_seconds": 0.0,
+                    "queue_depth": 0, "max_queue_depth": 0}
+            for stage in STAGES
+        }
+        batch_id = uuid.uuid4().hex
+        order = itertools.count()  # FIFO tie-break between equal priorities
+        start_time = time.time()
+
+        async def emit(record):
+            outcome = (on_result or self._print_result)(record)
+            if inspect.isawaitable(outcome):
+                await outcome
+
+        async def put(stage, priority, item):
+            await queues[stage].put((priority, next(order), item))
+            metrics = self.stage_metrics[stage]
+            metrics["queue_depth"] = queues[stage].qsize()
+            metrics["max_queue_depth"] = max(metrics["max_queue_depth"], metrics["queue_depth"])
+            pipeline_queue_depth.labels(stage=stage).set(metrics["queue_depth"])
+
+        async def worker(stage):
+            metrics = self.stage_metrics[stage]
+            next_stage = STAGES[STAGES.index(stage) + 1] if stage != STAGES[-1] else None
+            while True:
+                priority, _, item = await queues[stage].get()
+                metrics["queue_depth"] = queues[stage].qsize()
+                pipeline_queue_depth.labels(stage=stage).set(metrics["queue_depth"])
+                if item is None:  # shutdown sentinel
+                    return
+                started = time.time()
+                try:
+                    output = await handlers[stage](item)
+                    error = None if output else f"{stage} stage produced no result"
+                except Exception as e:
+                    output, error = None, f"{type(e).__name__}: {e}"
+                metrics["busy_seconds"] += time.time() - started
+                item[stage] = output
+                if error:
+                    metrics["failed"] += 1
+                    pipeline_stage_items.labels(stage=stage, status="failed").inc()
+                    await emit(self._record(item, "failed", stage, error))
+                    continue
+                metrics["processed"] += 1
+                pipeline_stage_items.labels(stage=stage, status="ok").inc()
+                if next_stage:
+                    await put(next_stage, priority, item)
+                else:
+                    await emit(self._record(item, "ok"))
+
+        stage_tasks = {stage: [asyncio.create_task(worker(stage)) for _ in range(workers[stage])]
+                       for stage in STAGES}
+        try:
+            if hasattr(tasks, "__aiter__"):
+                async for priority, file_path in tasks:
+                    await put("ingest", priority, {"file_path": file_path, "priority": priority, "batch_id": batch_id})
+            else:
+                for priority, file_path in tasks:
+                    await put("ingest", priority, {"file_path": file_path, "priority": priority, "batch_id": batch_id})
+            # Drain stage by stage: sentinels sort after every real item of the stage they close
+            for stage in STAGES:
+                for _ in range(workers[stage]):
+                    await queues[stage].put((math.inf, next(order), None))
+                await asyncio.gather(*stage_tasks[stage])
+        finally:
+            for task in itertools.chain(*stage_tasks.values()):
+                task.cancel()
+
+        elapsed = time.time() - start_time
+        for stage, metrics in self.stage_metrics.items():
+            metrics["throughput"] = metrics["processed"] / elapsed if elapsed else 0.0
+            # Utilization near 1.0 marks the bottleneck stage
+            metrics["utilization"] = metrics["busy_seconds"] / (elapsed * metrics["workers"]) if elapsed else 0.0
+        return self.stage_metrics
 
-    async def run_pipeline_queue(self, tasks):
-        # tasks: List of tuples (priority, file_path)
-        queue = asyncio.PriorityQueue()
-        for priority, file_path in tasks:
-            await queue.put((priority, file_path))
-        total = queue.qsize()
-        completed = 0
-        
-        async def worker():
-            nonlocal completed
-            while not queue.empty():
-                priority, file_path = await queue.get()
-                print(f"\n🔄 Processing {file_path} with priority {priority} ({completed+1}/{total})")
-                await self.execute_pipeline(file_path, priority)
-                completed += 1
-                queue.task_done()
-        
-        # Launch concurrent workers (e.g., 3 concurrent tasks)
-        workers = [asyncio.create_task(worker()) for _ in range(3)]
-        await queue.join()
-        for w in workers:
-            w.cancel()
+    def _record(self, item, status, failed_stage=None, error=None):
+        return {
+            "file_path": item["file_path"],
+            "priority": item["priority"],
+            "status": status,
+            "failed_stage": failed_stage,
+            "error": error,
+            "document": item.get("ingest"),
+            "summary": item.get("summarize"),
+            "email": item.get("email"),
+        }
@@ -0,0 +1,40 @@
+"""Encode/decode timings for event log records: binary frames vs the legacy JSON lines.
+
+Run from the project root with ``python -m tests.bench_event_encoding``. Kept
+out of the test suite because wall-clock comparisons are noisy on shared CI.
+"""
+import io
+import json
+import time
+
+from orchestrator.event_codec import MAGIC, encode_record, iter_records
+from orchestrator.event_queue import Event
+
+def _timed(func, repeat=5):
+    # Best of several runs keeps one-off scheduler noise out of the result
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main(count=20000):
+    data = {"type": "pipeline", "file_path": "reports/q3.pdf"}
+    events = [Event(f"evt-{i}", {**data, "n": i}, i % 10) for i in range(count)]
+    records = [{"op": "publish", "event_id": e.event_id, "data": e.data, "priority": e.priority,
+                "timestamp": e.timestamp} for e in events]
+
+    json_encode, as_json = _timed(lambda: [(json.dumps(r) + "\n").encode("utf-8") for r in records])
+    binary_encode, frames = _timed(lambda: [encode_record(r) for r in records])
+    json_blob, binary_blob = b"".join(as_json), MAGIC + b"".join(frames)
+    json_decode, _ = _timed(lambda: [json.loads(line) for line in io.BytesIO(json_blob)])
+    binary_decode, _ = _timed(lambda: list(iter_records(io.BytesIO(binary_blob))))
+
+    print(f"{count} publish records")
+    print(f"{'':8}{'bytes':>12}{'encode s':>12}{'decode s':>12}")
+    print(f"{'json':8}{len(json_blob):>12}{json_encode:>12.4f}{json_decode:>12.4f}")
+    print(f"{'binary':8}{len(binary_blob):>12}{binary_encode:>12.4f}{binary_decode:>12.4f}")
+
+if __name__ == "__main__":
+    main()
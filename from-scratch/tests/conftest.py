@@ -0,0 +1,25 @@
+import pytest
+import pytest_asyncio
+from tests.stub_openai_server import StubOpenAIServer
+from utils import model_router
+from utils.config import config
+
+@pytest.fixture(autouse=True)
+def reset_model_routers():
+    # Circuit breaker state is process-wide; keep failures injected by one test out of the next
+    model_router._routers.clear()
+    yield
+    model_router._routers.clear()
+
+@pytest.fixture(autouse=True)
+def isolated_caches(tmp_path, monkeypatch):
+    # Default agents get caches and a cost ledger under tmp_path, so no state leaks into the tree or across tests
+    monkeypatch.setattr(config._config, "ingest_cache_path", str(tmp_path / "ingest.sqlite3"))
+    monkeypatch.setenv("SUMMARY_CACHE_PATH", str(tmp_path / "summaries.sqlite3"))
+    monkeypatch.setenv("COST_LEDGER_PATH", str(tmp_path / "cost_ledger.sqlite3"))
+
+@pytest_asyncio.fixture
+async def stub_openai():
+    server = await StubOpenAIServer(delay=0.3).start()
+    yield server
+    await server.stop()
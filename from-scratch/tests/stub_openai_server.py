@@ -0,0 +1,61 @@
+import asyncio
+import time
+from aiohttp import web
+
+class StubOpenAIServer:
+    """Local OpenAI-compatible chat completions server for tests.
+
+    Every request sleeps for ``delay`` seconds before answering with ``reply``,
+    and the server records request counts and peak concurrency so tests can
+    check how calls overlap.
+    """
+    def __init__(self, reply="This is a stub summary of the document.", delay=0.0):
+        self.reply = reply
+        self.delay = delay
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._runner = None
+        self.base_url = None
+
+    async def _chat_completions(self, request):
+        body = await request.json()
+        self.requests += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        prompt_tokens = sum(len(m["content"]) // 4 for m in body["messages"])
+        completion_tokens = len(self.reply) // 4
+        return web.json_response({
+            "id": f"chatcmpl-stub-{self.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": self.reply},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self._chat_completions)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.base_url = f"http://127.0.0.1:{port}/v1"
+        return self
+
+    async def stop(self):
+        await self._runner.cleanup()
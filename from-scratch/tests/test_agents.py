@@ -1,4 +1,8 @@
 import asyncio
+import heapq
+import io
+import json
+import os
 import time
 import random
 import string
@@ -9,8 +13,20 @@ from unittest.mock import patch, AsyncMock, MagicMock
 from agents.summarizer_agent import SummarizerAgent
 from agents.email_agent import EmailAgent
 from orchestrator.task_manager import TaskManager
+from orchestrator.bulk_ingest import run_bulk
+from orchestrator.event_queue import Event, EventQueue, make_pipeline_handler
+from orchestrator.sqlite_event_queue import SQLiteEventQueue
+from orchestrator.event_codec import encode_record, iter_records
 from agents.doc_ingest_agent import DocumentIngestionAgent
 from agents.task_router_agent import TaskRouterAgent
+from agents.base_agent import BaseAgent
+from utils.cache import DiskCache, MemoryCache, SingleFlight, TieredCache
+from utils.rate_limiter import RateLimiter
+from utils.model_router import ModelRouter
+from utils.cost_ledger import BudgetExceededError, CostLedger, price
+from utils.tokenizer import chunk_text, count_tokens
+from utils.metrics import LatencyHistogram
+from utils.config import config
 
 # Dummy ingestion agent for integration tests
 class DummyIngestionAgent:
@@ -26,6 +42,29 @@ def generate_test_data(num_chars=100):
     metadata = {"file_name": "test.txt", "recipient": "test@example.com"}
     return {"text": text, "metadata": metadata}
 
+# Minimal PDF writer so PDF extraction can be tested without binary fixtures
+def make_pdf(path, page_texts):
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in page_texts:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+    out, offsets = "%PDF-1.4\n", []
+    for i, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{i} 0 obj\n{obj}\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n"
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    with open(path, "w", encoding="latin-1") as f:
+        f.write(out)
+
 # Unit test: DocumentIngestionAgent
 def test_doc_ingest_agent():
     agent = DocumentIngestionAgent()
@@ -33,6 +72,204 @@ def test_doc_ingest_agent():
     assert "text" in result and "metadata" in result, "Document ingestion failed"
     assert len(result["text"]) > 0, "Extracted text should not be empty"
 
+# Unit test: streaming extraction yields bounded, contiguous chunks
+def test_doc_ingest_iter_text():
+    agent = DocumentIngestionAgent()
+    agent.CHUNK_SIZE = 16
+    chunks = list(agent.iter_text("tests/sample.txt"))
+    assert len(chunks) > 1, "Expected the sample to be split into several chunks"
+    offset = 0
+    for chunk_offset, chunk in chunks:
+        assert chunk_offset == offset, "Chunk offsets should be contiguous"
+        assert 0 < len(chunk) <= agent.CHUNK_SIZE, "Chunk exceeds CHUNK_SIZE"
+        offset += len(chunk)
+    text = "".join(chunk for _, chunk in chunks)
+    assert text.strip() == agent.process("tests/sample.txt")["text"]
+
+# Unit test: parallel PDF extraction keeps page order
+def test_doc_ingest_parallel_pdf(tmp_path):
+    pdf_path = str(tmp_path / "report.pdf")
+    make_pdf(pdf_path, [f"Page number {i}" for i in range(40)])
+    serial = DocumentIngestionAgent(workers=1, cache=False).process(pdf_path)["text"]
+    parallel = DocumentIngestionAgent(workers=4, cache=False).process(pdf_path)["text"]
+    assert "Page number 0" in serial and "Page number 39" in serial
+    assert parallel == serial, "Parallel extraction should match serial page order"
+
+# Unit test: extraction cache hits skip parsing entirely
+def test_doc_ingest_cache(tmp_path):
+    agent = DocumentIngestionAgent(cache=DiskCache(str(tmp_path / "ingest.sqlite3")))
+    first = agent.process("tests/sample.txt")
+
+    def fail_extraction(file_path):
+        raise AssertionError("Cache hit should not re-parse the document")
+
+    agent._select_extractor = fail_extraction
+    second = agent.process("tests/sample.txt")
+    assert second == first, "Cached result differs from the original extraction"
+    assert agent.metrics["cache_hits"] == 1 and agent.metrics["cache_misses"] == 1
+
+# Unit test: HTML tags and entities split across chunk boundaries
+def test_doc_ingest_html_chunk_boundaries(tmp_path):
+    html_path = tmp_path / "archive.html"
+    html_path.write_text(
+        "<html><head><style>p { color: red; }</style></head><body>"
+        "<p>Fish &amp; Chips</p><p class=\"long-attribute-value\">Second paragraph</p>"
+        "</body></html>", encoding="utf-8")
+    agent = DocumentIngestionAgent(cache=False)
+    agent.CHUNK_SIZE = 7
+    text = agent.process(str(html_path))["text"]
+    assert text.split("\n") == ["Fish & Chips", "", "Second paragraph"]
+
+# Unit test: streaming DOCX reader includes paragraphs and table cells
+def test_doc_ingest_docx_tables(tmp_path):
+    import docx
+    document = docx.Document()
+    document.add_paragraph("Contract overview")
+    table = document.add_table(rows=2, cols=2)
+    table.cell(0, 0).text, table.cell(0, 1).text = "Party", "Role"
+    table.cell(1, 0).text, table.cell(1, 1).text = "Acme", "Supplier"
+    document.add_paragraph("Signed by both parties")
+    docx_path = str(tmp_path / "contract.docx")
+    document.save(docx_path)
+
+    text = DocumentIngestionAgent(cache=False).process(docx_path)["text"]
+    assert text.split("\n") == ["Contract overview", "Party\tRole", "Acme\tSupplier", "Signed by both parties"]
+
+# EPUB with six chapters whose spine lists them in reverse
+def write_test_epub(tmp_path):
+    from ebooklib import epub
+    book = epub.EpubBook()
+    book.set_identifier("book-1")
+    book.set_title("Annual Report")
+    book.set_language("en")
+    chapters = []
+    for i in range(6):
+        chapter = epub.EpubHtml(title=f"Chapter {i}", file_name=f"chap_{i}.xhtml", lang="en")
+        chapter.content = f"<html><body><h1>Chapter {i}</h1><p>Body of chapter {i}</p></body></html>"
+        book.add_item(chapter)
+        chapters.append(chapter)
+    book.add_item(epub.EpubNcx())
+    book.add_item(epub.EpubNav())
+    book.spine = list(reversed(chapters))
+    epub_path = str(tmp_path / "report.epub")
+    epub.write_epub(epub_path, book)
+    return epub_path
+
+# Unit test: EPUB chapters are parsed in parallel and kept in spine order
+def test_doc_ingest_epub_spine_order(tmp_path):
+    epub_path = write_test_epub(tmp_path)
+    text = DocumentIngestionAgent(workers=2, cache=False).process(epub_path)["text"]
+    positions = [text.index(f"Body of chapter {i}") for i in reversed(range(6))]
+    assert positions == sorted(positions), "Chapters should follow the spine order"
+
+# Agent whose work hangs or fails, for deadline tests
+class SlowAgent(BaseAgent):
+    def __init__(self, delay=0.0, fail=False):
+        super().__init__("SlowAgent")
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+
+    def process(self, data):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("transient failure")
+        return data
+
+# Unit test: execute/aexecute enforce the timeout and stop retrying at the deadline
+@pytest.mark.asyncio
+async def test_base_agent_deadlines():
+    start = time.time()
+    assert SlowAgent(delay=2).execute("doc", timeout=0.2) is None
+    assert await SlowAgent(delay=2).aexecute("doc", timeout=0.2) is None
+    failing = SlowAgent(fail=True)
+    assert failing.execute("doc", timeout=0.5, retries=5, backoff=1) is None
+    assert failing.calls == 1, "Backoff longer than the remaining deadline should stop retries"
+    assert time.time() - start < 1.5, "Hung calls must not outlive their deadline"
+    assert SlowAgent().execute("doc", timeout=1) == "doc"
+
+# Unit test: execute() cancels an async process() at the deadline instead of leaving it running
+def test_execute_cancels_abandoned_coroutine():
+    class HangingAsyncAgent(BaseAgent):
+        def __init__(self):
+            super().__init__("HangingAsyncAgent")
+            self.cancelled = False
+
+        async def process(self, data):
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                self.cancelled = True
+                raise
+
+    agent = HangingAsyncAgent()
+    assert agent.execute("doc", timeout=0.2, retries=1) is None
+    time.sleep(0.1)
+    assert agent.cancelled, "The abandoned attempt should be cancelled, not left spending tokens"
+
+# Unit test: log-bucketed histogram answers percentiles within its bucket error
+def test_latency_histogram_percentiles():
+    histogram = LatencyHistogram()
+    for i in range(1, 1001):
+        histogram.record(i / 1000)  # 1 ms .. 1 s uniformly
+    summary = histogram.summary()
+    assert summary["count"] == 1000
+    for q, expected in ((50, 0.5), (95, 0.95), (99, 0.99)):
+        assert expected <= summary[f"p{q}"] <= expected * histogram.growth + 1e-9
+
+    agent = SlowAgent()
+    for _ in range(3):
+        agent.execute("doc", timeout=1)
+    agent.execute("doc", timeout=1, retries=0)
+    assert agent.latency_percentiles()["count"] == 3
+    assert agent.latency_percentiles("failure")["count"] == 1
+
+# Agents reporting where aprocess ran, per execution class
+class WhereAgent(BaseAgent):
+    def __init__(self, execution_class):
+        super().__init__("WhereAgent")
+        self.execution_class = execution_class
+
+    def process(self, data):
+        import os, threading
+        return os.getpid(), threading.get_ident()
+
+# Unit test: aprocess dispatches to the shared pool of the declared execution class
+@pytest.mark.asyncio
+async def test_agent_execution_classes(tmp_path):
+    import os, threading
+    main_thread = threading.get_ident()
+    assert await WhereAgent("inline").aprocess(None) == (os.getpid(), main_thread)
+    pid, thread = await WhereAgent("io").aprocess(None)
+    assert pid == os.getpid() and thread != main_thread
+    pid, _ = await WhereAgent("cpu").aprocess(None)
+    assert pid != os.getpid(), "CPU agents should run in the shared process pool"
+
+    agent = DocumentIngestionAgent(cache=DiskCache(str(tmp_path / "ingest.sqlite3")))
+    first = await agent.aprocess("tests/sample.txt")
+    second = await agent.aprocess("tests/sample.txt")
+    assert first == second
+    assert agent.metrics["cache_misses"] == 1 and agent.metrics["cache_hits"] == 1
+
+# Unit test: aprocess keeps chapter fan-out on the CPU pool instead of parsing the whole book in one worker
+@pytest.mark.asyncio
+async def test_doc_ingest_aprocess_fans_out(tmp_path):
+    epub_path = write_test_epub(tmp_path)
+    agent = DocumentIngestionAgent(workers=2, cache=False)
+    submitted = []
+    imap_ordered = agent._imap_ordered
+
+    def spy(func, arg_tuples):
+        for args, result in imap_ordered(func, arg_tuples):
+            submitted.append(args)
+            yield args, result
+
+    agent._imap_ordered = spy
+    result = await agent.aprocess(epub_path)
+    assert len(submitted) == 6, "Every chapter should be handed to the CPU pool"
+    assert result == DocumentIngestionAgent(workers=1, cache=False).process(epub_path)
+
 # Unit test: TaskRouterAgent
 @pytest.mark.asyncio
 async def test_task_router_agent():
@@ -41,6 +278,21 @@ async def test_task_router_agent():
     assert isinstance(result, dict), "Result should be a dictionary"
     assert "document" in result and "summary" in result, "Task routing failed"
 
+# Unit test: the single-document path ingests under INGEST_TIMEOUT, not the generic TIMEOUT
+@pytest.mark.asyncio
+async def test_task_router_stage_deadlines(monkeypatch):
+    class Summarizer:
+        async def process(self, data):
+            return {"summary": "summary", "metadata": {}}
+
+    monkeypatch.setattr(config._config, "timeout", 0.1)
+    monkeypatch.setattr(config._config, "ingest_timeout", 5.0)
+    agent = TaskRouterAgent()
+    agent.doc_agent = SlowAgent(delay=0.3)
+    agent.summarizer = Summarizer()
+    result = await agent.process({"text": "slow document", "metadata": {}})
+    assert result is not None and result["summary"]["summary"] == "summary"
+
 # Integration test: Run end-to-end pipeline using a dummy ingestion agent
 @pytest.mark.asyncio
 async def test_pipeline_integration(monkeypatch):
@@ -49,6 +301,113 @@ async def test_pipeline_integration(monkeypatch):
     result = await tm.execute_pipeline("dummy_file.txt", priority=3)
     assert result is not None, "Pipeline execution failed"
 
+# Staged pipeline: stages overlap, priorities order each queue, bounded queues push back
+@pytest.mark.asyncio
+async def test_staged_pipeline_queue():
+    class SlowIngestion:
+        async def aprocess(self, file_path):
+            await asyncio.sleep(0.1)
+            if file_path == "bad.txt":
+                raise ValueError("corrupted")
+            return {"text": file_path, "metadata": {"file_name": file_path}}
+
+    class SlowSummarizer:
+        async def process(self, data):
+            await asyncio.sleep(0.1)
+            return {"summary": f"summary of {data['text']}", "metadata": data["metadata"]}
+
+    tm = TaskManager()
+    tm.ingestion_agent = SlowIngestion()
+    tm.summarizer_agent = SlowSummarizer()
+    results = []
+    tasks = [(5, f"doc{i}.txt") for i in range(6)] + [(1, "urgent.txt"), (5, "bad.txt")]
+    start = time.time()
+    metrics = await tm.run_pipeline_queue(tasks, stage_workers={"ingest": 1, "summarize": 1, "email": 1},
+                                          on_result=results.append, queue_size=1)
+    elapsed = time.time() - start
+
+    assert elapsed < 1.3, f"Stages did not overlap: {elapsed:.2f}s"  # serial stages take ~1.5s
+    done = [r["file_path"] for r in results if r["status"] == "ok"]
+    assert done[:6] == [f"doc{i}.txt" for i in range(6)]  # FIFO within a priority
+    failed = [r for r in results if r["status"] == "failed"]
+    assert len(failed) == 1 and failed[0]["failed_stage"] == "ingest" and "corrupted" in failed[0]["error"]
+    assert metrics["ingest"]["processed"] == 7 and metrics["ingest"]["failed"] == 1
+    assert metrics["email"]["processed"] == 7
+    assert all(m["max_queue_depth"] <= 1 for m in metrics.values())
+    assert metrics["summarize"]["throughput"] > 0
+
+# Stage deadlines: a hung summarization fails its document instead of stalling the stage worker
+@pytest.mark.asyncio
+async def test_pipeline_stage_deadline(monkeypatch):
+    class Ingestion:
+        async def aprocess(self, file_path):
+            return {"text": file_path, "metadata": {}}
+
+    class HangingSummarizer:
+        async def process(self, data):
+            if data["text"] == "hung.txt":
+                await asyncio.sleep(60)
+            return {"summary": "summary", "metadata": {}}
+
+    monkeypatch.setattr(config._config, "summarize_timeout", 0.2)
+    tm = TaskManager()
+    tm.ingestion_agent = Ingestion()
+    tm.summarizer_agent = HangingSummarizer()
+    results = []
+    await asyncio.wait_for(tm.run_pipeline_queue([(1, "hung.txt"), (5, "doc.txt")], stage_workers={"summarize": 1},
+                                                 on_result=results.append), timeout=5)
+    by_path = {record["file_path"]: record for record in results}
+    assert by_path["hung.txt"]["failed_stage"] == "summarize" and "deadline" in by_path["hung.txt"]["error"]
+    assert by_path["doc.txt"]["status"] == "ok"
+
+# Bulk mode: results stream to JSONL and a rerun resumes from the checkpoint journal
+@pytest.mark.asyncio
+async def test_bulk_ingest_resume(tmp_path):
+    class FakeIngestion:
+        def __init__(self):
+            self.seen = []
+
+        async def aprocess(self, file_path):
+            self.seen.append(os.path.basename(file_path))
+            if file_path.endswith("bad.txt"):
+                raise ValueError("corrupted")
+            return {"text": "text", "metadata": {"file_name": file_path}}
+
+    class FakeSummarizer:
+        async def process(self, data):
+            return {"summary": "summary", "metadata": data["metadata"]}
+
+    docs = tmp_path / "docs"
+    (docs / "nested").mkdir(parents=True)
+    for name in ["a.txt", "nested/b.txt", "bad.txt"]:
+        (docs / name).write_text("content")
+    (docs / "notes.bin").write_text("ignored")
+    output = tmp_path / "results.jsonl"
+
+    tm = TaskManager()
+    tm.ingestion_agent, tm.summarizer_agent = FakeIngestion(), FakeSummarizer()
+    totals = await run_bulk(str(docs), str(output), task_manager=tm, stream=io.StringIO())
+    assert (totals["ok"], totals["failed"], totals["skipped"]) == (2, 1, 0)
+    lines = [json.loads(line) for line in output.read_text().splitlines()]
+    assert sorted(line["status"] for line in lines) == ["failed", "ok", "ok"]
+
+    # A rerun only retries the failure and any file changed since it was processed
+    (docs / "a.txt").write_text("edited content")
+    tm.ingestion_agent = FakeIngestion()
+    totals = await run_bulk(str(docs), str(output), task_manager=tm, stream=io.StringIO())
+    assert sorted(tm.ingestion_agent.seen) == ["a.txt", "bad.txt"]
+    assert totals["skipped"] == 1 and len(output.read_text().splitlines()) == 5
+
+    # A manifest entry that does not exist fails on its own instead of aborting the run
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text("docs/a.txt\ndocs/missing.txt\n")
+    missing_output = tmp_path / "missing.jsonl"
+    totals = await run_bulk(str(manifest), str(missing_output), task_manager=tm, stream=io.StringIO())
+    assert (totals["ok"], totals["failed"]) == (1, 1)
+    lines = [json.loads(line) for line in missing_output.read_text().splitlines()]
+    [failed] = [line for line in lines if line["status"] == "failed"]
+    assert failed["failed_stage"] == "ingest" and "FileNotFoundError" in failed["error"]
+
 # Performance test: Verify summarizer performance under threshold
 @pytest.mark.asyncio
 async def test_summarizer_performance():
@@ -114,3 +473,653 @@ async def test_summarizer_with_mock(monkeypatch):
     test_input = generate_test_data()
     result = await agent.process(test_input)
     assert result["summary"] == "Mocked summary", "Mocking failed"
+
+# Map-reduce summarization for documents larger than the single-call limit
+@pytest.mark.asyncio
+async def test_summarizer_map_reduce(monkeypatch):
+    agent = SummarizerAgent()
+    agent.config.max_input_tokens = 60
+    agent.config.chunk_tokens = 50
+    agent.config.chunk_overlap = 5
+    prompts = []
+
+    async def fake_create(model, messages):
+        prompts.append(messages[0]["content"])
+        response = MagicMock()
+        response.choices = [MagicMock(message=MagicMock(content="A concise partial summary of the text."))]
+        response.usage = MagicMock(total_tokens=10)
+        return response
+
+    mock_client = MagicMock()
+    mock_client.chat.completions.create = fake_create
+    monkeypatch.setattr(agent, "client", mock_client)
+
+    result = await agent.process(generate_test_data(num_chars=2000))
+    stages = result["metadata"]["stages"]
+    assert result["summary"] == "A concise partial summary of the text."
+    assert stages[0]["stage"] == "map" and stages[0]["calls"] > 1
+    assert stages[-1]["stage"].startswith("reduce") and stages[-1]["calls"] == 1
+    assert prompts.count(SummarizerAgent.MAP_PROMPT) == stages[0]["calls"]
+    assert result["metadata"]["cost"] == pytest.approx(len(prompts) * 10 * agent.config.cost_rate)
+
+# Summary cache survives a restart through the shared disk tier
+@pytest.mark.asyncio
+async def test_summarizer_persistent_cache(tmp_path, monkeypatch):
+    def make_agent():
+        cache = TieredCache(MemoryCache(), DiskCache(str(tmp_path / "summaries.sqlite3")))
+        agent = SummarizerAgent(cache=cache)
+        mock_response = MagicMock()
+        mock_response.choices = [MagicMock(message=MagicMock(content="A cached summary of the document."))]
+        mock_response.usage = MagicMock(total_tokens=100)
+        mock_client = MagicMock()
+        mock_client.chat.completions.create = AsyncMock(return_value=mock_response)
+        monkeypatch.setattr(agent, "client", mock_client)
+        return agent
+
+    test_input = generate_test_data()
+    first = make_agent()
+    await first.process(test_input)
+    restarted = make_agent()
+    # whitespace differences normalize to the same key
+    result = await restarted.process({**test_input, "text": "  " + test_input["text"] + "\n"})
+    assert result["summary"] == "A cached summary of the document."
+    assert result["metadata"]["cost"] == 0.0
+    restarted.client.chat.completions.create.assert_not_called()
+    assert restarted.cache.hit_rate() == 1.0
+
+# Memory tier evicts least recently used entries by size and expires by TTL
+def test_memory_cache_bounds():
+    cache = MemoryCache(max_bytes=40)
+    cache.set("a", "x" * 15)
+    cache.set("b", "y" * 15)
+    cache.get("a")
+    cache.set("c", "z" * 15)
+    assert cache.get("b") is None and cache.get("a") is not None
+    assert cache.size_bytes() <= 40
+    cache.set("d", "short", ttl=-1)
+    assert cache.get("d") is None
+
+# Concurrent summarizations overlap on the async client, bounded by the process-wide limiter
+@pytest.mark.asyncio
+async def test_summarizer_async_concurrency(stub_openai, tmp_path):
+    agent = SummarizerAgent(cache=TieredCache(MemoryCache()))
+    agent.config.base_url = stub_openai.base_url
+    agent.config.max_concurrency = 3
+    start = time.time()
+    results = await asyncio.gather(*(agent.process(generate_test_data()) for _ in range(6)))
+    elapsed = time.time() - start
+    assert all(r["summary"] == stub_openai.reply for r in results)
+    assert stub_openai.peak_in_flight == 3, "Requests should overlap up to the concurrency limit"
+    assert elapsed < 6 * stub_openai.delay, f"Summaries were serialized: {elapsed:.2f}s"
+
+# Identical documents arriving together share one in-flight LLM request
+@pytest.mark.asyncio
+async def test_summarizer_single_flight(stub_openai):
+    agent = SummarizerAgent(cache=TieredCache(MemoryCache()))
+    agent.config.base_url = stub_openai.base_url
+    test_input = generate_test_data()
+    results = await asyncio.gather(*(agent.process(dict(test_input)) for _ in range(5)))
+    assert stub_openai.requests == 1, "Duplicate documents should be coalesced"
+    assert all(r["summary"] == stub_openai.reply for r in results)
+    assert agent.metrics["coalesced"] == 4
+    assert sum(r["metadata"]["cost"] for r in results) == results[0]["metadata"]["cost"]
+
+# Failures reach every waiter and are not remembered
+@pytest.mark.asyncio
+async def test_single_flight_failure_propagates():
+    flight = SingleFlight()
+    calls = 0
+
+    async def flaky():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        raise RuntimeError("provider outage")
+
+    results = await asyncio.gather(*(flight.do("key", flaky) for _ in range(3)), return_exceptions=True)
+    assert calls == 1 and all(isinstance(r, RuntimeError) for r in results)
+    assert not flight.in_flight("key")
+    with pytest.raises(RuntimeError):
+        await flight.do("key", flaky)
+    assert calls == 2, "A failed call must not be reused by later callers"
+
+# Token-bucket limiter queues callers in order and corrects estimates after the call
+@pytest.mark.asyncio
+async def test_rate_limiter_fair_queueing():
+    limiter = RateLimiter(rpm=600, tpm=6000)  # 100 tokens per second
+    await limiter.acquire(6000)
+    limiter.reconcile(6000, 5950)  # the call used fewer tokens than reserved
+    order = []
+
+    async def caller(i):
+        await limiter.acquire(50)
+        order.append(i)
+
+    start = time.time()
+    await asyncio.gather(*(caller(i) for i in range(3)))
+    elapsed = time.time() - start
+    assert order == [0, 1, 2], "Waiters should be served in arrival order"
+    assert 0.8 < elapsed < 2, f"Expected ~1s of quota waiting, got {elapsed:.2f}s"
+
+# Circuit breakers skip degraded models and recover through a half-open trial call
+def test_model_router_circuit_breaker():
+    router = ModelRouter(["gpt-4", "gpt-3.5-turbo"], min_calls=3, cooldown=0.2)
+    assert router.route(1000) == ["gpt-4", "gpt-3.5-turbo"]
+    assert router.route(12000) == ["gpt-3.5-turbo"], "Large prompts need the larger context window"
+    for _ in range(3):
+        assert router.acquire("gpt-4")
+        router.record("gpt-4", False, 5.0)
+    assert router.route(1000) == ["gpt-3.5-turbo"], "Open circuit should be skipped"
+    assert not router.acquire("gpt-4")
+
+    time.sleep(0.25)
+    assert router.acquire("gpt-4"), "Half-open circuit admits one trial call"
+    assert not router.acquire("gpt-4"), "Only a single trial call is admitted"
+    router.record("gpt-4", True, 0.5)
+    assert router.stats()["gpt-4"]["state"] == "closed"
+
+    for _ in range(5):
+        router.record("gpt-3.5-turbo", True, 3.0)
+    assert router.route(1000, latency_budget=1.0) == ["gpt-4", "gpt-3.5-turbo"]
+    router.breakers["gpt-4"].window.extend([(True, 4.0)] * 5)
+    assert router.route(1000, latency_budget=3.5) == ["gpt-3.5-turbo", "gpt-4"]
+
+# A cancelled half-open trial call gives its slot back instead of wedging the circuit
+@pytest.mark.asyncio
+async def test_cancelled_trial_releases_circuit(monkeypatch):
+    agent = SummarizerAgent(cache=TieredCache(MemoryCache()))
+    agent.router = ModelRouter(["gpt-4", "gpt-3.5-turbo"], min_calls=1, cooldown=0.0)
+    agent.router.record("gpt-4", False, 1.0)
+    agent.router.record("gpt-3.5-turbo", False, 1.0)
+    started = asyncio.Event()
+
+    async def hanging_create(*args, **kwargs):
+        started.set()
+        await asyncio.sleep(60)
+
+    mock_client = MagicMock()
+    mock_client.chat.completions.create = hanging_create
+    monkeypatch.setattr(agent, "client", mock_client)
+    task = asyncio.create_task(agent._call_models(agent.SYSTEM_PROMPT, "text"))
+    await started.wait()
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert agent.router.acquire("gpt-4"), "The trial slot must be free after cancellation"
+
+# The breaker records endpoint latency only, not time spent waiting for our own rate limiter
+@pytest.mark.asyncio
+async def test_breaker_latency_excludes_local_queueing(stub_openai, monkeypatch):
+    class SlowLimiter:
+        async def acquire(self, tokens):
+            await asyncio.sleep(0.5)
+
+        def reconcile(self, reserved, used):
+            pass
+
+    monkeypatch.setattr("agents.summarizer_agent.get_rate_limiter", lambda model: SlowLimiter())
+    agent = SummarizerAgent(cache=TieredCache(MemoryCache()))
+    agent.config.base_url = stub_openai.base_url
+    assert await agent._call_models(agent.SYSTEM_PROMPT, "text") is not None
+    [(success, latency)] = agent.router.breakers["gpt-4"].window
+    assert success and latency < 0.45, f"{latency:.2f}s includes the limiter wait"
+
+# Cost ledger prices prompt/completion tokens per model and aggregates per document and batch
+@pytest.mark.asyncio
+async def test_summarizer_cost_ledger(stub_openai, tmp_path):
+    ledger = CostLedger(str(tmp_path / "ledger.sqlite3"))
+    agent = SummarizerAgent(cache=TieredCache(MemoryCache()), ledger=ledger)
+    agent.config.base_url = stub_openai.base_url
+    docs = [generate_test_data() for _ in range(2)]
+    for i, doc in enumerate(docs):
+        doc["metadata"].update({"document_id": f"doc-{i}", "batch_id": "batch-1"})
+    results = await asyncio.gather(*(agent.process(doc) for doc in docs))
+
+    doc_totals = ledger.document_totals("doc-0")
+    assert doc_totals["calls"] == 1 and doc_totals["completion_tokens"] > 0
+    expected = (doc_totals["prompt_tokens"] * 0.03 + doc_totals["completion_tokens"] * 0.06) / 1000
+    assert doc_totals["cost"] == pytest.approx(expected)
+    assert results[0]["metadata"]["cost"] == pytest.approx(expected)
+    assert ledger.batch_totals("batch-1")["cost"] == pytest.approx(sum(r["metadata"]["cost"] for r in results))
+
+    agent.config.max_document_cost = 1e-6
+    with pytest.raises(BudgetExceededError):
+        await agent.process(generate_test_data())
+    assert stub_openai.requests == 2, "Over-budget documents must be rejected before any call"
+
+# Cost projection prices each chunk with the model it will be routed to, not the one the whole text fits
+def test_summarizer_projects_cost_per_chunk():
+    agent = SummarizerAgent(cache=TieredCache(MemoryCache()))
+    text = " ".join(random.choice(["alpha", "beta", "gamma"]) for _ in range(12000))
+    text_tokens = count_tokens(text)
+    assert agent.router.route(text_tokens)[0] == "gpt-3.5-turbo", "Only the larger window fits the whole text"
+    chunks = chunk_text(text, agent.config.chunk_tokens, agent.config.chunk_overlap)
+    assert agent._project_cost(text_tokens, chunks) > price("gpt-4", text_tokens, 0)
+
+# Event queue WAL: restart recovers only unacknowledged events and compaction bounds the log
+@pytest.mark.asyncio
+async def test_event_queue_wal_recovery(tmp_path):
+    log_path = str(tmp_path / "events.json")
+    with open(log_path, "w") as f:  # legacy events.json lines are read as publish records
+        f.write(json.dumps({"event_id": "legacy", "data": {"n": 0}, "priority": 1, "timestamp": 1.0}) + "\n")
+    queue = EventQueue(log_path, compact_threshold=6)
+    queue.register_handler(None, lambda event: None)
+    for i in range(1, 6):
+        queue.publish(Event(f"evt-{i}", {"n": i}, priority=5, timestamp=float(i)))
+    for _ in range(4):
+        event = heapq.heappop(queue.queue)
+        await queue.process_event(event)
+    queue.flush()  # compactions triggered on the loop finish on the I/O pool
+    assert queue.metrics["compactions"] == 2  # legacy migration on load, then one from the acks
+    queue.close()
+
+    recovered = EventQueue(log_path)
+    assert sorted(recovered.pending) == ["evt-4", "evt-5"]
+    assert [event.event_id for event in sorted(recovered.queue)] == ["evt-4", "evt-5"]
+    with open(log_path, "rb") as f:
+        assert len(list(iter_records(f))) == 2, "Log should hold only the pending events after recovery"
+    recovered.close()
+
+# A crash mid-append leaves a torn frame; it is cut off on load so later appends stay readable
+def test_event_queue_torn_tail(tmp_path):
+    log_path = str(tmp_path / "events.log")
+    queue = EventQueue(log_path)
+    for i in range(3):
+        queue.publish(Event(f"evt-{i}", {"n": i}, timestamp=float(i)))
+    queue.close()
+    with open(log_path, "ab") as f:
+        f.write(encode_record({"op": "publish", "event_id": "torn", "data": {}, "priority": 5, "timestamp": 3.0})[:-2])
+
+    restarted = EventQueue(log_path)
+    assert sorted(restarted.pending) == ["evt-0", "evt-1", "evt-2"]
+    assert restarted.metrics["truncated_bytes"] > 0
+    restarted.publish(Event("new", {"n": 4}, timestamp=4.0))
+    restarted.flush()
+    restarted.close()
+
+    recovered = EventQueue(log_path)
+    assert sorted(recovered.pending) == ["evt-0", "evt-1", "evt-2", "new"]
+    recovered.close()
+
+# Group commit: concurrent publishers share fsyncs and can await durability
+@pytest.mark.asyncio
+async def test_event_queue_group_commit(tmp_path):
+    log_path = str(tmp_path / "events.log")
+    queue = EventQueue(log_path, flush_interval=0.01)
+    futures = [queue.publish(Event(f"evt-{i}", {"n": i})) for i in range(500)]
+    await queue.publish_durable(Event("last", {"n": 500}))
+    assert all(future.done() for future in futures), "Earlier records commit no later than the last one"
+    stats = queue.get_metrics()["writer"]
+    assert stats["records"] == 501 and stats["fsyncs"] == stats["batches"]
+    assert stats["batches"] < 50, f"Publishes were not grouped: {stats['batches']} batches"
+    with open(log_path, "rb") as f:
+        assert len(list(iter_records(f))) == 501
+    queue.close()
+
+# Consumer pool: handlers by event type, priority order at dequeue, concurrent I/O-bound handling
+@pytest.mark.asyncio
+async def test_event_queue_consumers(tmp_path):
+    queue = EventQueue(str(tmp_path / "events.log"))
+    handled = []
+
+    async def fetch(event):
+        await asyncio.sleep(0.05)
+        handled.append(event.event_id)
+
+    queue.register_handler("fetch", fetch)
+    for i in range(20):
+        queue.publish(Event(f"evt-{i}", {"type": "fetch"}, priority=i % 3, timestamp=float(i)))
+    queue.publish(Event("orphan", {"type": "unknown"}, priority=0, timestamp=100.0))
+
+    start = time.time()
+    events = await queue.replay_events(consumers=10)
+    assert time.time() - start < 0.5, "Consumers should overlap I/O-bound handlers"  # serial: ~1s
+    priorities = [event.priority for event in events]
+    assert priorities == sorted(priorities), "Consumers must dequeue in priority order"
+    assert len(handled) == 20 and [event.event_id for event in queue.dead_letter_queue] == ["orphan"]
+
+    # Long-running pool: idle consumers wake on publish and drain before stopping
+    calls = []
+
+    class FakeTaskManager:
+        async def execute_pipeline(self, file_path, priority=5, batch_id=None):
+            calls.append((file_path, priority))
+            return {"summary": "ok"}
+
+    queue.register_handler("pipeline", make_pipeline_handler(FakeTaskManager()))
+    queue.start_consumers(2)
+    await asyncio.sleep(0.05)
+    queue.publish(Event("doc", {"type": "pipeline", "file_path": "report.pdf"}, priority=2))
+    await queue.stop(timeout=5)
+    assert calls == [("report.pdf", 2)] and "doc" not in queue.pending
+    queue.close()
+
+# Publishers on other threads hand the heap mutation to the loop the consumers run on
+@pytest.mark.asyncio
+async def test_event_queue_cross_thread_publish(tmp_path):
+    queue = EventQueue(str(tmp_path / "events.log"))
+    handled = []
+
+    async def handle(event):
+        handled.append(event.event_id)
+
+    def publish_many(thread):
+        for i in range(200):
+            queue.publish(Event(f"evt-{thread}-{i}", {"type": "job"}, priority=random.randint(1, 5)))
+
+    queue.register_handler("job", handle)
+    queue.start_consumers(4)
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*(loop.run_in_executor(None, publish_many, thread) for thread in range(4)))
+    await queue.stop()
+    assert sorted(handled) == sorted(f"evt-{thread}-{i}" for thread in range(4) for i in range(200))
+    assert queue.pending == {} and queue.queue == []
+    queue.close()
+
+# A cross-thread publish that is durable before a compaction snapshot survives the log swap
+@pytest.mark.asyncio
+async def test_event_queue_cross_thread_publish_during_compaction(tmp_path):
+    import threading
+    log_path = str(tmp_path / "events.log")
+    queue = EventQueue(log_path, compact_threshold=1)
+
+    def publish_late():
+        queue.publish(Event("late", {"type": "slow"})).result()
+
+    async def handle_first(event):
+        # Blocks the loop until the late publish is durable, so its heap push is still queued at the ack
+        thread = threading.Thread(target=publish_late)
+        thread.start()
+        thread.join()
+
+    async def handle_slow(event):
+        await asyncio.sleep(60)
+
+    queue.register_handler("job", handle_first)
+    queue.register_handler("slow", handle_slow)
+    queue.start_consumers(1)
+    queue.publish(Event("first", {"type": "job"}))
+    await asyncio.sleep(0.2)
+    await queue.stop(timeout=0.1)
+    queue.flush()
+    assert queue.metrics["compactions"] >= 1
+    queue.close()
+
+    restarted = EventQueue(log_path)
+    assert sorted(restarted.pending) == ["late"]
+    restarted.close()
+
+# Compaction triggered by an ack writes and fsyncs the snapshot off the event loop
+@pytest.mark.asyncio
+async def test_event_queue_compaction_off_loop(tmp_path):
+    import threading
+    queue = EventQueue(str(tmp_path / "events.log"), compact_threshold=4)
+    queue.register_handler(None, lambda event: None)
+    threads = []
+    write_snapshot = queue._write_snapshot
+
+    def tracking_write(snapshot):
+        threads.append(threading.current_thread())
+        write_snapshot(snapshot)
+
+    queue._write_snapshot = tracking_write
+    for i in range(4):
+        queue.publish(Event(f"evt-{i}", {"n": i}))
+    for _ in range(3):
+        await queue.process_event(heapq.heappop(queue.queue))
+    queue.publish(Event("evt-4", {"n": 4}))  # may land during the compaction; it must survive the swap
+    queue.flush()
+    assert threads and threading.current_thread() not in threads
+    assert queue.metrics["compactions"] == 1
+    queue.close()
+
+    restarted = EventQueue(str(tmp_path / "events.log"))
+    assert sorted(restarted.pending) == ["evt-3", "evt-4"]
+    restarted.close()
+
+# Failed events are redelivered with backoff, then dead-lettered to a file that can be replayed
+@pytest.mark.asyncio
+async def test_event_queue_redelivery_and_dead_letters(tmp_path):
+    log_path = str(tmp_path / "events.log")
+    queue = EventQueue(log_path)
+    queue.max_attempts, queue.retry_delay = 3, 0.05
+    failures = {"flaky": 2, "broken": 99}
+    deliveries = []
+
+    async def handle(event):
+        deliveries.append((event.event_id, time.time()))
+        if failures[event.event_id] > 0:
+            failures[event.event_id] -= 1
+            raise ConnectionError("LLM unavailable")
+
+    queue.register_handler("job", handle)
+    queue.start_consumers(2)
+    queue.publish(Event("flaky", {"type": "job"}))
+    queue.publish(Event("broken", {"type": "job"}))
+    await asyncio.sleep(0.6)
+    await queue.stop()
+
+    flaky = [at for event_id, at in deliveries if event_id == "flaky"]
+    assert len(flaky) == 3 and flaky[2] - flaky[1] > flaky[1] - flaky[0], "Delay should grow per attempt"
+    assert queue.metrics["retried"] == 4 and sorted(queue.pending) == []
+    queue.close()
+
+    restarted = EventQueue(log_path)
+    assert restarted.queue == [], "Dead-lettered events are not recovered from the log"
+    [dead] = restarted.inspect_dead_letters()
+    assert dead["event_id"] == "broken" and dead["attempts"] == 3 and "LLM unavailable" in dead["error"]
+
+    failures["broken"] = 0
+    restarted.register_handler("job", handle)
+    restarted.replay_dead_letters(["broken"])
+    await restarted.replay_events()
+    assert restarted.inspect_dead_letters() == [] and restarted.metrics["processed"] == 1
+    restarted.close()
+
+# Attempt counts and the last error survive a restart and a compaction of the log
+@pytest.mark.asyncio
+async def test_event_queue_attempts_survive_compaction(tmp_path):
+    log_path = str(tmp_path / "events.log")
+    queue = EventQueue(log_path)
+    queue.retry_delay = 60
+
+    async def handle(event):
+        raise ConnectionError("LLM unavailable")
+
+    queue.register_handler("job", handle)
+    queue.publish(Event("flaky", {"type": "job"}))
+    await queue.process_event(heapq.heappop(queue.queue))
+    queue.compact()
+    queue.close()
+
+    for _ in range(2):  # the second start reads the snapshot written by the first
+        restarted = EventQueue(log_path)
+        restarted.compact()
+        event = restarted.pending["flaky"]
+        assert event.attempts == 1 and "LLM unavailable" in event.last_error
+        restarted.close()
+
+# SQLite backend: priority-ordered claims, no double delivery across queues, lease expiry
+@pytest.mark.asyncio
+async def test_sqlite_event_queue(tmp_path):
+    db_path = str(tmp_path / "events.sqlite3")
+    first, second = SQLiteEventQueue(db_path), SQLiteEventQueue(db_path)
+    for i, priority in enumerate([3, 1, 2]):
+        first.publish(Event(f"order-{i}", {"type": "job"}, priority=priority, timestamp=float(i)))
+    first.flush()
+    claimed = [second._claim() for _ in range(3)]
+    assert [event.event_id for event in claimed] == ["order-1", "order-2", "order-0"]
+    for event in claimed:
+        second.ack(event)
+
+    handled = []
+
+    async def handle(event):
+        await asyncio.sleep(0.01)
+        handled.append(event.event_id)
+
+    for queue in (first, second):
+        queue.register_handler("job", handle)
+    for i in range(40):
+        first.publish(Event(f"evt-{i}", {"type": "job", "n": i}))
+    await asyncio.gather(first.replay_events(consumers=4), second.replay_events(consumers=4))
+    assert sorted(handled) == sorted(f"evt-{i}" for i in range(40)), "Each event is delivered exactly once"
+    assert first.get_metrics()["statuses"] == {}
+
+    # A crashed consumer's lease expires and another queue takes the event over
+    crashed = SQLiteEventQueue(db_path, lease_seconds=0.05)
+    crashed.publish(Event("orphaned", {"type": "job"}))
+    crashed.flush()
+    lost = crashed._claim()
+    assert first._claim() is None
+    await asyncio.sleep(0.1)
+    recovered = first._claim()
+    assert recovered.event_id == "orphaned" and recovered.attempts == 1
+    crashed.ack(lost)  # the expired lease no longer owns the event
+    first.ack(recovered)
+    assert first.get_metrics()["statuses"] == {}
+    for queue in (first, second, crashed):
+        queue.close()
+
+# SQLite backend: an event whose worker keeps dying is dead-lettered once expired leases reach max_attempts
+def test_sqlite_event_queue_poison_event(tmp_path):
+    db_path = str(tmp_path / "events.sqlite3")
+    queue = SQLiteEventQueue(db_path, lease_seconds=0.05)
+    queue.max_attempts = 2
+    queue.publish(Event("poison", {"type": "job"}))
+    queue.flush()
+    for attempt in range(2):
+        assert queue._claim().attempts == attempt  # the worker "crashes" without settling
+        time.sleep(0.1)
+    assert queue._claim() is None
+    [dead] = queue.inspect_dead_letters()
+    assert dead["event_id"] == "poison" and dead["attempts"] == 2 and dead["error"] == "lease expired"
+    assert queue.metrics["dead_lettered"] == 1
+    queue.close()
+
+# SQLite backend: a handler that outlives lease_seconds keeps its lease through heartbeats
+@pytest.mark.asyncio
+async def test_sqlite_event_queue_lease_heartbeat(tmp_path):
+    db_path = str(tmp_path / "events.sqlite3")
+    queues = [SQLiteEventQueue(db_path, lease_seconds=0.2, poll_interval=0.05) for _ in range(2)]
+    deliveries = []
+
+    async def handle(event):
+        deliveries.append(event.event_id)
+        await asyncio.sleep(0.5)
+
+    for queue in queues:
+        queue.register_handler("job", handle)
+        queue.start_consumers(1)
+    await queues[0].publish_durable(Event("slow", {"type": "job"}))
+    await asyncio.sleep(0.8)
+    for queue in queues:
+        await queue.stop(timeout=1)
+    assert deliveries == ["slow"], "A live lease must not be claimed by another consumer"
+    assert queues[0].get_metrics()["statuses"] == {}
+    for queue in queues:
+        queue.close()
+
+# Slotted events and binary frames: smaller queued footprint and log than dict/JSON (timings: tests/bench_event_encoding.py)
+def test_event_footprint_and_encoding(tmp_path):
+    import tracemalloc
+
+    class LegacyEvent:  # the original per-instance __dict__ event
+        def __init__(self, event_id, data, priority=5, timestamp=None):
+            self.event_id, self.data, self.priority = event_id, data, priority
+            self.timestamp = timestamp if timestamp else time.time()
+
+    def queued_bytes(build):
+        tracemalloc.start()
+        heap = build()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        assert len(heap) == 10000
+        return size / len(heap)
+
+    data = {"type": "pipeline", "file_path": "reports/q3.pdf"}
+    legacy = queued_bytes(lambda: [(5, float(i), LegacyEvent(f"evt-{i}", data, 5, float(i))) for i in range(10000)])
+    slotted = queued_bytes(lambda: [Event(f"evt-{i}", data, 5, float(i)) for i in range(10000)])
+    assert slotted < legacy * 0.8, f"{slotted:.0f} B/event vs {legacy:.0f} B/event"
+
+    events = [Event(f"evt-{i}", {**data, "n": i}, i % 10) for i in range(20000)]
+    assert sorted(events)[0].priority == 0 and events[0] < events[10]  # total order, no tuple wrapping
+    records = [{"op": "publish", "event_id": e.event_id, "data": e.data, "priority": e.priority,
+                "timestamp": e.timestamp} for e in events]
+    as_json = [(json.dumps(r) + "\n").encode("utf-8") for r in records]
+    frames = [encode_record(r) for r in records]
+    assert sum(map(len, frames)) < sum(map(len, as_json)) * 0.8
+
+    # A legacy events.json is adopted as events.log and migrated to the binary format on first load
+    (tmp_path / "events.json").write_bytes(b"".join(as_json[:3]))
+    log_path = tmp_path / "events.log"
+    queue = EventQueue(str(log_path))
+    assert sorted(queue.pending) == ["evt-0", "evt-1", "evt-2"]
+    assert (tmp_path / "events.log.bak").exists() and not (tmp_path / "events.json").exists()
+    queue.close()
+    with open(log_path, "rb") as f:
+        assert f.read(4) == b"EVQ\x01"
+
+# Logging only enqueues: one listener per log file formats off the caller thread and drops on overflow
+def test_queued_logging(tmp_path):
+    import threading
+    from utils import logger as logger_module
+    log_path = str(tmp_path / "agents.log")
+    first = logger_module.setup_logger("queued-a", log_file=log_path, queue_size=10)
+    second = logger_module.setup_logger("queued-b", log_file=log_path)
+    assert first.handlers[0].sink is second.handlers[0].sink, "Loggers sharing a file share one sink"
+
+    formatting_threads = set()
+    original_format = logger_module.JsonFormatter.format
+
+    def tracking_format(self, record):
+        formatting_threads.add(threading.get_ident())
+        return original_format(self, record)
+
+    with patch.object(logger_module.JsonFormatter, "format", tracking_format):
+        first.info("chunk %d processed", 1)
+        second.warning("retrying")
+        logger_module.flush_logs()
+    assert formatting_threads and threading.get_ident() not in formatting_threads
+
+    sink = first.handlers[0].sink
+    sink.listener.stop()  # stall the writer so the bounded queue fills up
+    for i in range(50):
+        first.info("burst %d", i)
+    assert logger_module.log_sink_stats()[log_path] == {"queued": 10, "dropped": 40}
+    sink.listener.start()
+    logger_module.flush_logs()
+    with open(log_path) as f:
+        messages = [json.loads(line)["message"] for line in f]
+    assert messages == ["chunk 1 processed", "retrying"] + [f"burst {i}" for i in range(10)]
+
+# LLM request slots cap in-flight calls across every event loop in the process
+def test_llm_slot_is_process_wide():
+    import threading
+    from utils.llm_client import llm_slot
+    lock = threading.Lock()
+    active = []
+    peak = []
+
+    async def call():
+        async with llm_slot(3):
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            await asyncio.sleep(0.01)
+            with lock:
+                active.pop()
+
+    async def run_loop():
+        waiters = [asyncio.ensure_future(call()) for _ in range(10)]
+        waiters[-1].cancel()  # a cancelled waiter must not leak its slot
+        await asyncio.gather(*waiters, return_exceptions=True)
+
+    threads = [threading.Thread(target=asyncio.run, args=(run_loop(),)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(peak) == 3
+    assert len(peak) == 36
+    asyncio.run(asyncio.wait_for(call(), 1))  # every slot was returned
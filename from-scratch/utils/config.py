@@ -5,6 +5,21 @@ from functools import lru_cache
 import json
 from pathlib import Path
 
+# Per-model provider settings; MODEL_SETTINGS (JSON) overrides individual models and keys.
+# Prices are USD per 1K prompt / completion tokens.
+DEFAULT_MODEL_SETTINGS: Dict[str, Dict[str, float]] = {
+    "gpt-4": {"rpm": 500, "tpm": 30000, "context_window": 8192,
+              "prompt_price": 0.03, "completion_price": 0.06},
+    "gpt-3.5-turbo": {"rpm": 3500, "tpm": 90000, "context_window": 16385,
+                      "prompt_price": 0.0005, "completion_price": 0.0015},
+}
+
+def _load_model_settings() -> Dict[str, Dict[str, float]]:
+    settings = {model: dict(values) for model, values in DEFAULT_MODEL_SETTINGS.items()}
+    for model, values in json.loads(os.getenv("MODEL_SETTINGS", "{}")).items():
+        settings.setdefault(model, {}).update(values)
+    return settings
+
 class AppConfig(BaseModel):
     """Application configuration with validation"""
     version: str = Field(default="1.0.0", description="Configuration version")
@@ -15,6 +30,32 @@ class AppConfig(BaseModel):
     log_level: str = Field(default="INFO", description="Logging level")
     max_retries: int = Field(default=3, description="Maximum retry attempts")
     timeout: int = Field(default=30, description="Operation timeout in seconds")
+    cpu_workers: int = Field(default=os.cpu_count() or 1, description="Shared process pool size for CPU-bound agents")
+    io_workers: int = Field(default=32, description="Shared thread pool size for I/O-bound agents")
+    ingest_cache_path: str = Field(default=".cache/ingest.sqlite3", description="Extraction cache file, empty to disable")
+    ingest_cache_max_bytes: int = Field(default=512 * 1024 * 1024, description="Extraction cache size limit in bytes")
+    ingest_workers: int = Field(default=os.cpu_count() or 1, description="Pipeline ingestion stage workers")
+    summarize_workers: int = Field(default=8, description="Pipeline summarization stage workers")
+    email_workers: int = Field(default=2, description="Pipeline email stage workers")
+    stage_queue_size: int = Field(default=32, description="Bounded queue size in front of each pipeline stage")
+    ingest_timeout: float = Field(default=300.0, description="Per-document ingestion stage deadline in seconds (0 = none)")
+    summarize_timeout: float = Field(default=600.0, description="Per-document summarization stage deadline in seconds (0 = none)")
+    email_timeout: float = Field(default=60.0, description="Per-document email stage deadline in seconds (0 = none)")
+    event_flush_interval: float = Field(default=0.005, description="Seconds the event log waits to group records into one commit")
+    event_batch_size: int = Field(default=512, description="Maximum event log records per group commit")
+    event_fsync: bool = Field(default=True, description="fsync the event log on every group commit")
+    event_consumers: int = Field(default=4, description="Concurrent EventQueue consumers")
+    event_max_attempts: int = Field(default=5, description="Deliveries before an event is dead-lettered")
+    event_retry_delay: float = Field(default=1.0, description="Initial EventQueue redelivery delay in seconds, doubled per attempt")
+    event_retry_max_delay: float = Field(default=300.0, description="Upper bound on the EventQueue redelivery delay")
+    event_lease_seconds: float = Field(default=300.0, description="How long a SQLiteEventQueue consumer owns a claimed event")
+    event_poll_interval: float = Field(default=0.5, description="Idle SQLiteEventQueue consumers re-check for work from other processes this often")
+    log_queue_size: int = Field(default=10000, description="Log records buffered per log file before new ones are dropped")
+    metrics_port: int = Field(default=0, description="Local Prometheus metrics port, 0 to disable")
+    model_settings: Dict[str, Dict[str, float]] = Field(
+        default_factory=lambda: {model: dict(values) for model, values in DEFAULT_MODEL_SETTINGS.items()},
+        description="Per-model settings: rpm/tpm quotas, context window, prompt/completion prices",
+    )
 
 class Config:
     """Configuration manager with hot reload and validation"""
@@ -44,7 +85,30 @@ class Config:
             secret_manager=os.getenv("SECRET_MANAGER", "local"),
             log_level=os.getenv("LOG_LEVEL", "INFO"),
             max_retries=int(os.getenv("MAX_RETRIES", "3")),
-            timeout=int(os.getenv("TIMEOUT", "30"))
+            timeout=int(os.getenv("TIMEOUT", "30")),
+            cpu_workers=int(os.getenv("CPU_WORKERS", str(os.cpu_count() or 1))),
+            io_workers=int(os.getenv("IO_WORKERS", "32")),
+            ingest_cache_path=os.getenv("INGEST_CACHE_PATH", ".cache/ingest.sqlite3"),
+            ingest_cache_max_bytes=int(os.getenv("INGEST_CACHE_MAX_BYTES", str(512 * 1024 * 1024))),
+            ingest_workers=int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1))),
+            summarize_workers=int(os.getenv("SUMMARIZE_WORKERS", "8")),
+            email_workers=int(os.getenv("EMAIL_WORKERS", "2")),
+            stage_queue_size=int(os.getenv("STAGE_QUEUE_SIZE", "32")),
+            ingest_timeout=float(os.getenv("INGEST_TIMEOUT", "300")),
+            summarize_timeout=float(os.getenv("SUMMARIZE_TIMEOUT", "600")),
+            email_timeout=float(os.getenv("EMAIL_TIMEOUT", "60")),
+            event_flush_interval=float(os.getenv("EVENT_FLUSH_INTERVAL", "0.005")),
+            event_batch_size=int(os.getenv("EVENT_BATCH_SIZE", "512")),
+            event_fsync=os.getenv("EVENT_FSYNC", "true").lower() in ("true", "1", "yes"),
+            event_consumers=int(os.getenv("EVENT_CONSUMERS", "4")),
+            event_max_attempts=int(os.getenv("EVENT_MAX_ATTEMPTS", "5")),
+            event_retry_delay=float(os.getenv("EVENT_RETRY_DELAY", "1.0")),
+            event_retry_max_delay=float(os.getenv("EVENT_RETRY_MAX_DELAY", "300")),
+            event_lease_seconds=float(os.getenv("EVENT_LEASE_SECONDS", "300")),
+            event_poll_interval=float(os.getenv("EVENT_POLL_INTERVAL", "0.5")),
+            log_queue_size=int(os.getenv("LOG_QUEUE_SIZE", "10000")),
+            metrics_port=int(os.getenv("METRICS_PORT", "0")),
+            model_settings=_load_model_settings()
         )
 
     def reload(self) -> None:
@@ -0,0 +1,75 @@
+import contextvars
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from utils.config import config
+from utils.logger import llm_cost, llm_tokens
+
+# Document and batch the current LLM calls are billed to; set per document by the summarizer
+cost_context: contextvars.ContextVar = contextvars.ContextVar("cost_context", default={})
+
+class BudgetExceededError(ValueError):
+    """Raised before any LLM call when a document's projected cost exceeds the budget"""
+
+def price(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """USD cost of a call using the per-model prompt/completion prices"""
+    settings = config.get("model_settings").get(model, {})
+    return (prompt_tokens * settings.get("prompt_price", 0.0)
+            + completion_tokens * settings.get("completion_price", 0.0)) / 1000.0
+
+class CostLedger:
+    """Persists every LLM call's token usage and cost to SQLite for per-document/batch reporting"""
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        if path:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_calls ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, batch_id TEXT, document_id TEXT, model TEXT NOT NULL, "
+                "prompt_tokens INTEGER NOT NULL, completion_tokens INTEGER NOT NULL, cost REAL NOT NULL, "
+                "created REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_calls_document ON llm_calls (document_id)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_calls_batch ON llm_calls (batch_id)")
+
+    def record(self, model: str, prompt_tokens: int, completion_tokens: int, cost: float) -> None:
+        """Record one call against the document/batch in cost_context and update Prometheus counters"""
+        llm_tokens.labels(model=model, kind="prompt").inc(prompt_tokens)
+        llm_tokens.labels(model=model, kind="completion").inc(completion_tokens)
+        llm_cost.labels(model=model).inc(cost)
+        if self._conn is None:
+            return
+        context = cost_context.get()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO llm_calls (batch_id, document_id, model, prompt_tokens, completion_tokens, cost, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (context.get("batch_id"), context.get("document_id"), model,
+                 prompt_tokens, completion_tokens, cost, time.time()),
+            )
+
+    def _totals(self, column: str, value: str) -> Dict[str, Any]:
+        totals = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0}
+        if self._conn is None:
+            return totals
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(prompt_tokens), 0), COALESCE(SUM(completion_tokens), 0), "
+                f"COALESCE(SUM(cost), 0) FROM llm_calls WHERE {column} = ?", (value,)
+            ).fetchone()
+        return dict(zip(totals, row))
+
+    def document_totals(self, document_id: str) -> Dict[str, Any]:
+        """Aggregate calls, tokens and cost for one document"""
+        return self._totals("document_id", document_id)
+
+    def batch_totals(self, batch_id: str) -> Dict[str, Any]:
+        """Aggregate calls, tokens and cost for one batch"""
+        return self._totals("batch_id", batch_id)
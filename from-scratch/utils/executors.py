@@ -0,0 +1,73 @@
+import asyncio
+import atexit
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Optional
+
+from utils.config import config
+
+# Execution classes an agent can declare
+CPU, IO, INLINE = "cpu", "io", "inline"
+
+_executors: Dict[str, Executor] = {}
+_lock = threading.Lock()
+_in_worker = False
+_background_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def _mark_worker() -> None:
+    # Process pool initializer: workers must not start pools of their own
+    global _in_worker
+    _in_worker = True
+
+def in_worker_process() -> bool:
+    """Whether the caller runs inside a shared CPU pool worker"""
+    return _in_worker
+
+def get_executor(kind: str) -> Optional[Executor]:
+    """Return the process-wide pool for an execution class.
+
+    "cpu" maps to a process pool sized by CPU_WORKERS and "io" to a thread
+    pool sized by IO_WORKERS. Inside a CPU worker process there is no nested
+    CPU pool and None is returned, so callers fall back to running inline.
+    """
+    if kind == CPU and _in_worker:
+        return None
+    with _lock:
+        if kind not in _executors:
+            if kind == CPU:
+                _executors[kind] = ProcessPoolExecutor(
+                    max_workers=config.get("cpu_workers"), initializer=_mark_worker)
+            elif kind == IO:
+                _executors[kind] = ThreadPoolExecutor(
+                    max_workers=config.get("io_workers"), thread_name_prefix="agent-io")
+            else:
+                raise ValueError(f"Unknown execution class: {kind}")
+        return _executors[kind]
+
+def get_background_loop() -> asyncio.AbstractEventLoop:
+    """Return the process-wide event loop that runs coroutines for synchronous callers.
+
+    The loop runs forever on a daemon thread. Unlike a pool thread, a
+    coroutine submitted with asyncio.run_coroutine_threadsafe stops when
+    the returned Future is cancelled.
+    """
+    global _background_loop
+    with _lock:
+        if _background_loop is None:
+            _background_loop = asyncio.new_event_loop()
+            threading.Thread(target=_background_loop.run_forever, name="agent-loop", daemon=True).start()
+        return _background_loop
+
+def shutdown_executors(wait: bool = True) -> None:
+    """Shut down every shared pool; they are recreated on next use"""
+    global _background_loop
+    with _lock:
+        executors = list(_executors.values())
+        _executors.clear()
+        loop, _background_loop = _background_loop, None
+    for executor in executors:
+        executor.shutdown(wait=wait, cancel_futures=True)
+    if loop is not None:
+        loop.call_soon_threadsafe(loop.stop)
+
+atexit.register(shutdown_executors)
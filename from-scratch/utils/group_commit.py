@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+
+class GroupCommitWriter:
+    """Append-only file writer that batches records into group commits.
+
+    submit() only enqueues; one background thread keeps the file open, waits
+    up to flush_interval for more records to arrive, then writes the whole
+    batch and issues a single fsync. Each submit returns a Future resolved
+    once its record is durable (or written, with fsync disabled), so callers
+    choose per record whether to wait for durability.
+
+    hold() / release() bracket a swap: records submitted in between are kept
+    back and committed to the file swapped in, while earlier ones still
+    go to the old file before swap() replaces it.
+    """
+    def __init__(self, path: str, flush_interval: float = 0.005, max_batch: int = 512, fsync: bool = True):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.fsync = fsync
+        self.metrics = {"records": 0, "batches": 0, "bytes": 0, "fsyncs": 0, "fsync_seconds": 0.0,
+                        "max_batch": 0, "errors": 0}
+        self._pending: List[Tuple[bytes, Future]] = []
+        self._held: Optional[List[Tuple[bytes, Future]]] = None  # submitted during hold()
+        self._busy = False  # a batch is being written
+        self._cond = threading.Condition()
+        self._io_lock = threading.Lock()  # held while a batch is written or the file is swapped
+        self._last: Optional[Future] = None
+        self._closed = False
+        self._file = open(path, "ab")
+        self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+        self._thread.start()
+
+    def submit(self, record: bytes) -> Future:
+        """Queue record for appending; the returned Future resolves once it is committed"""
+        future: Future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("writer is closed")
+            (self._pending if self._held is None else self._held).append((record, future))
+            self._last = future
+            self._cond.notify_all()
+        return future
+
+    def flush(self, timeout: Optional[float] = None) -> None:
+        """Block until every record submitted so far is committed"""
+        last = self._last
+        if last is not None:
+            last.exception(timeout)
+
+    def hold(self) -> None:
+        """Keep records submitted from now on out of the current file until release()"""
+        with self._cond:
+            if self._held is None:
+                self._held = []
+
+    def release(self) -> int:
+        """Let records held since hold() commit; returns how many there were"""
+        with self._cond:
+            held, self._held = self._held or [], None
+            self._pending.extend(held)
+            self._cond.notify_all()
+        return len(held)
+
+    def swap(self, replace: Callable[[], None]) -> None:
+        """Run replace() (e.g. an atomic rename over path) between batches, then reopen path.
+
+        During hold(), first waits for the records submitted before it to be committed.
+        """
+        with self._cond:
+            while self._held is not None and (self._pending or self._busy):
+                self._cond.wait()
+        with self._io_lock:
+            self._file.close()
+            try:
+                replace()
+            finally:
+                self._file = open(self.path, "ab")
+
+    def stats(self) -> Dict[str, float]:
+        """Counters plus the average batch size and fsync latency"""
+        batches = self.metrics["batches"]
+        fsyncs = self.metrics["fsyncs"]
+        return {**self.metrics,
+                "avg_batch": self.metrics["records"] / batches if batches else 0.0,
+                "avg_fsync_seconds": self.metrics["fsync_seconds"] / fsyncs if fsyncs else 0.0}
+
+    def close(self) -> None:
+        """Commit everything still queued and stop the writer thread"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._pending.extend(self._held or [])
+            self._held = None
+            self._cond.notify_all()
+        self._thread.join()
+        self._file.close()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                fill = len(self._pending) < self.max_batch and not self._closed
+            if fill and self.flush_interval:
+                time.sleep(self.flush_interval)  # commit delay: let concurrent publishers join the batch
+            with self._cond:
+                batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+                self._busy = True
+            self._commit(batch)
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+    def _commit(self, batch: List[Tuple[bytes, Future]]) -> None:
+        data = b"".join(record for record, _ in batch)
+        try:
+            with self._io_lock:
+                self._file.write(data)
+                self._file.flush()
+                if self.fsync:
+                    started = time.perf_counter()
+                    os.fsync(self._file.fileno())
+                    self.metrics["fsync_seconds"] += time.perf_counter() - started
+                    self.metrics["fsyncs"] += 1
+        except Exception as e:
+            self.metrics["errors"] += 1
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        self.metrics["records"] += len(batch)
+        self.metrics["batches"] += 1
+        self.metrics["bytes"] += len(data)
+        self.metrics["max_batch"] = max(self.metrics["max_batch"], len(batch))
+        for _, future in batch:
+            future.set_result(None)
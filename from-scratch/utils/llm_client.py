@@ -0,0 +1,81 @@
+import asyncio
+import threading
+import weakref
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Tuple
+
+import openai
+
+# Clients are shared process-wide but keyed by event loop, because the pooled
+# HTTP transport must not cross loops. Request slots are counted per process.
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple, openai.AsyncOpenAI]]" = weakref.WeakKeyDictionary()
+_limiters: Dict[int, "_ProcessSlots"] = {}
+_limiters_lock = threading.Lock()
+
+class _ProcessSlots:
+    """Counting semaphore shared by every thread and event loop in the process"""
+
+    def __init__(self, limit: int):
+        self._lock = threading.Lock()
+        self._free = limit
+        self._waiters: Deque[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = deque()
+
+    async def acquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._free and not self._waiters:
+                self._free -= 1
+                return
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = waiter not in self._waiters
+                if not granted:
+                    self._waiters.remove(waiter)
+            if granted:  # the slot was handed over as we were cancelled; pass it on
+                self.release()
+            raise
+
+    def release(self) -> None:
+        with self._lock:
+            if not self._waiters:
+                self._free += 1
+                return
+            loop, future = self._waiters.popleft()
+        try:
+            loop.call_soon_threadsafe(_grant, future)
+        except RuntimeError:  # the waiter's loop is closed
+            self.release()
+
+def _grant(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+def get_async_client(config) -> openai.AsyncOpenAI:
+    """Return the pooled AsyncOpenAI client shared by all agents on the running loop"""
+    loop = asyncio.get_running_loop()
+    clients = _clients.setdefault(loop, {})
+    key = (config.api_key, config.base_url)
+    if key not in clients:
+        clients[key] = openai.AsyncOpenAI(
+            api_key=config.api_key,
+            base_url=config.base_url,
+            timeout=config.request_timeout,
+            max_retries=0,  # retries and model fallback are handled by the agents
+        )
+    return clients[key]
+
+@asynccontextmanager
+async def llm_slot(limit: int) -> AsyncIterator[None]:
+    """Hold one of the process-wide concurrent LLM request slots, across all event loops"""
+    with _limiters_lock:
+        slots = _limiters.setdefault(limit, _ProcessSlots(limit))
+    await slots.acquire()
+    try:
+        yield
+    finally:
+        slots.release()
@@ -1,19 +1,65 @@
 import logging
 import logging.handlers
 import json
+import atexit
+import os
+import queue
+import sys
+import threading
 from typing import Optional, Dict, Any
 from pathlib import Path
 import time
-from prometheus_client import Counter, Histogram
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+from utils.config import config
+
+try:
+    import orjson
+except ImportError:  # optional: faster JSON encoding for log records
+    orjson = None
 
 # Metrics
 log_entries = Counter('log_entries_total', 'Total number of log entries', ['level'])
 log_processing_time = Histogram('log_processing_seconds', 'Time spent processing logs')
+log_records_dropped = Counter('log_records_dropped_total', 'Log records dropped because the log queue was full')
+llm_tokens = Counter('llm_tokens_total', 'LLM tokens consumed', ['model', 'kind'])
+llm_cost = Counter('llm_cost_usd_total', 'LLM spend in USD', ['model'])
+agent_task_latency = Histogram(
+    'agent_task_duration_seconds', 'Agent task latency', ['agent', 'outcome'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, float('inf')),
+)
+pipeline_stage_items = Counter('pipeline_stage_items_total', 'Documents handled per pipeline stage', ['stage', 'status'])
+pipeline_queue_depth = Gauge('pipeline_queue_depth', 'Documents waiting in front of a pipeline stage', ['stage'])
+
+_metrics_server_started = False
+
+def start_metrics_server(port: int, addr: str = "127.0.0.1") -> None:
+    """Serve Prometheus metrics over HTTP on a local port (idempotent)"""
+    global _metrics_server_started
+    if not _metrics_server_started:
+        start_http_server(port, addr=addr)
+        _metrics_server_started = True
+
+def _dumps(obj: Dict[str, Any]) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj, default=str).decode("utf-8")
+    return json.dumps(obj, default=str)
 
 class JsonFormatter(logging.Formatter):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.default_msec_format = '%s.%03d'
+        self._second_cache = (None, "")  # (epoch second, formatted prefix)
+
+    def formatTime(self, record: logging.LogRecord, datefmt: Optional[str] = None) -> str:
+        """Format the record time, reusing the strftime result for records in the same second"""
+        if datefmt:
+            return super().formatTime(record, datefmt)
+        second = int(record.created)
+        cached_second, prefix = self._second_cache
+        if second != cached_second:
+            prefix = time.strftime(self.default_time_format, self.converter(record.created))
+            self._second_cache = (second, prefix)
+        return self.default_msec_format % (prefix, record.msecs)
 
     def format(self, record: logging.LogRecord) -> str:
         """Format log record as JSON with enhanced metadata"""
@@ -40,7 +86,7 @@ class JsonFormatter(logging.Formatter):
         if hasattr(record, "extra_data"):
             log_record["extra_data"] = record.extra_data
 
-        return json.dumps(log_record)
+        return _dumps(log_record)
 
 class MetricsFilter(logging.Filter):
     """Filter to collect metrics about logging"""
@@ -48,6 +94,105 @@ class MetricsFilter(logging.Filter):
         log_entries.labels(level=record.levelname).inc()
         return True
 
+class _SinkListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # The default put_nowait would fail on a full queue; wait so stop() always drains
+        self.queue.put(self._sentinel)
+
+class _LogSink:
+    """Bounded record queue plus one listener thread that formats and writes a log file.
+
+    Every logger writing to the same file shares one sink, so the file has a
+    single rotating handler. When the queue is full, records are dropped and
+    counted instead of blocking the caller.
+    """
+    def __init__(self, log_file: str, max_bytes: int, backup_count: int, queue_size: int):
+        self.log_file = log_file
+        self.formatter = JsonFormatter()
+        self.endpoints: set = set()
+        self.dropped = 0
+        rotating_handler = logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count)
+        rotating_handler.setFormatter(self.formatter)
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(self.formatter)
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.listener = _SinkListener(self.queue, rotating_handler, console_handler)
+        self.listener.start()
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            log_records_dropped.inc()
+
+    def add_shipping(self, endpoint: str) -> None:
+        if endpoint not in self.endpoints:
+            shipping_handler = LogShippingHandler(endpoint)
+            shipping_handler.setFormatter(self.formatter)
+            self.listener.handlers += (shipping_handler,)
+            self.endpoints.add(endpoint)
+
+    def flush(self) -> None:
+        self.queue.join()
+        for handler in self.listener.handlers:
+            handler.flush()
+
+    def restart(self) -> None:
+        # After fork the listener thread is gone and the queue's locks may be held: start afresh
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self.listener = _SinkListener(self.queue, *self.listener.handlers)
+        self.listener.start()
+
+    def stop(self) -> None:
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+class _SinkHandler(logging.handlers.QueueHandler):
+    """Per-logger O(1) hand-off to a shared sink"""
+    def __init__(self, sink: _LogSink):
+        super().__init__(sink.queue)
+        self.sink = sink
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only merge the arguments (they may be mutated later); JSON formatting runs on the listener
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        self.sink.enqueue(record)
+
+_sinks: Dict[str, _LogSink] = {}
+_sinks_lock = threading.Lock()
+
+def _get_sink(log_file: str, max_bytes: int, backup_count: int, queue_size: int) -> _LogSink:
+    path = os.path.abspath(log_file)
+    with _sinks_lock:
+        if path not in _sinks:
+            _sinks[path] = _LogSink(path, max_bytes, backup_count, queue_size)
+        return _sinks[path]
+
+def flush_logs() -> None:
+    """Block until every queued log record has been written"""
+    for sink in list(_sinks.values()):
+        sink.flush()
+
+def log_sink_stats() -> Dict[str, Dict[str, int]]:
+    """Queued and dropped record counts per log file"""
+    return {path: {"queued": sink.queue.qsize(), "dropped": sink.dropped} for path, sink in _sinks.items()}
+
+def _stop_sinks() -> None:
+    for sink in list(_sinks.values()):
+        sink.stop()
+
+def _restart_sinks_after_fork() -> None:
+    for sink in _sinks.values():
+        sink.restart()
+
+atexit.register(_stop_sinks)
+os.register_at_fork(after_in_child=_restart_sinks_after_fork)
+
 def setup_logger(
     name: str,
     log_file: str = "app.log",
@@ -56,8 +201,14 @@ def setup_logger(
     backup_count: int = 5,
     log_dir: Optional[str] = None,
     shipping_endpoint: Optional[str] = None,
+    queue_size: Optional[int] = None,
 ) -> logging.Logger:
-    """Configure logger with enhanced features"""
+    """Configure logger with enhanced features.
+
+    Logging calls only enqueue the record; a background listener per log file
+    formats and writes it (queue_size bounds that file's queue, default
+    log_queue_size from config).
+    """
     logger = logging.getLogger(name)
     logger.setLevel(level)
 
@@ -67,27 +218,16 @@ def setup_logger(
             Path(log_dir).mkdir(parents=True, exist_ok=True)
             log_file = str(Path(log_dir) / log_file)
 
-        # File handler with rotation
-        rotating_handler = logging.handlers.RotatingFileHandler(
-            log_file, maxBytes=max_bytes, backupCount=backup_count
-        )
-        formatter = JsonFormatter()
-        rotating_handler.setFormatter(formatter)
-        logger.addHandler(rotating_handler)
-
-        # Console handler
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
+        # Shared rotating file + console output for everything logged to log_file
+        sink = _get_sink(log_file, max_bytes, backup_count, queue_size or config.get("log_queue_size"))
+        logger.addHandler(_SinkHandler(sink))
 
         # Add metrics collection
         logger.addFilter(MetricsFilter())
 
         # Optional log shipping
         if shipping_endpoint:
-            shipping_handler = LogShippingHandler(shipping_endpoint)
-            shipping_handler.setFormatter(formatter)
-            logger.addHandler(shipping_handler)
+            sink.add_shipping(shipping_endpoint)
 
     return logger
 
@@ -114,7 +254,6 @@ class LogShippingHandler(logging.Handler):
                     self._ship_logs()
         except Exception as e:
             # Fallback to stderr in case of shipping failure
-            import sys
             print(f"Failed to ship log: {str(e)}", file=sys.stderr)
 
     def _ship_logs(self) -> None:
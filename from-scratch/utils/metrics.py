@@ -0,0 +1,58 @@
+import math
+import threading
+from typing import Dict, List
+
+class LatencyHistogram:
+    """Constant-memory latency histogram with logarithmic buckets.
+
+    Bucket boundaries grow geometrically by ``growth`` from ``min_value`` to
+    ``max_value`` seconds, so percentile queries carry a relative error of at
+    most ``growth - 1`` no matter how many samples were recorded.
+    """
+    def __init__(self, min_value: float = 1e-4, max_value: float = 3600.0, growth: float = 1.05):
+        self.min_value = min_value
+        self.growth = growth
+        self._log_growth = math.log(growth)
+        self._counts: List[int] = [0] * (self._index(max_value) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def _index(self, value: float) -> int:
+        if value <= self.min_value:
+            return 0
+        return math.ceil(math.log(value / self.min_value) / self._log_growth)
+
+    def record(self, value: float) -> None:
+        """Add one latency sample in seconds"""
+        with self._lock:
+            self._counts[min(self._index(value), len(self._counts) - 1)] += 1
+            self.count += 1
+            self.total += value
+            self.max = max(self.max, value)
+
+    def percentile(self, q: float) -> float:
+        """Latency at percentile q (0-100); 0.0 without samples"""
+        with self._lock:
+            if not self.count:
+                return 0.0
+            rank = max(1, math.ceil(self.count * q / 100))
+            seen = 0
+            for index, bucket_count in enumerate(self._counts):
+                seen += bucket_count
+                if seen >= rank:
+                    # bucket upper bound, never above the largest sample
+                    return min(self.min_value * self.growth ** index, self.max)
+            return self.max
+
+    def summary(self) -> Dict[str, float]:
+        """Count, mean and p50/p95/p99 latency"""
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
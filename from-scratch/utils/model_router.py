@@ -0,0 +1,141 @@
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional, Sequence
+
+from utils.config import config
+
+class CircuitBreaker:
+    """Rolling-window circuit breaker for one model endpoint.
+
+    The breaker opens when the error rate over the last ``window`` calls
+    reaches ``error_threshold``. After ``cooldown`` seconds it turns half-open
+    and admits a single trial call: success closes it, failure re-opens it.
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, window: int = 20, error_threshold: float = 0.5, min_calls: int = 5, cooldown: float = 30.0):
+        self.window = deque(maxlen=window)  # (success, latency) of recent calls
+        self.error_threshold = error_threshold
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        """Whether a call could be admitted right now (without claiming it)"""
+        with self._lock:
+            if self.state == self.OPEN:
+                return time.monotonic() - self._opened_at >= self.cooldown
+            if self.state == self.HALF_OPEN:
+                return not self._trial_in_flight
+            return True
+
+    def acquire(self) -> bool:
+        """Admit a call; in the half-open state only one trial call is admitted"""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.cooldown:
+                    return False
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN:
+                if self._trial_in_flight:
+                    return False
+                self._trial_in_flight = True
+            return True
+
+    def release(self) -> None:
+        """Give back an admitted call that produced no health signal (e.g. rate limited)"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record(self, success: bool, latency: float) -> None:
+        """Record the outcome of an admitted call and update the breaker state"""
+        with self._lock:
+            self.window.append((success, latency))
+            if self.state == self.HALF_OPEN:
+                self._trial_in_flight = False
+                if success:
+                    self.state = self.CLOSED
+                    self.window.clear()
+                else:
+                    self._open()
+            elif self.state == self.CLOSED and len(self.window) >= self.min_calls \
+                    and self._error_rate() >= self.error_threshold:
+                self._open()
+
+    def _open(self) -> None:
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+
+    def _error_rate(self) -> float:
+        return sum(1 for success, _ in self.window if not success) / len(self.window) if self.window else 0.0
+
+    def error_rate(self) -> float:
+        """Fraction of failed calls in the rolling window"""
+        with self._lock:
+            return self._error_rate()
+
+    def latency_percentile(self, q: float) -> Optional[float]:
+        """Latency percentile (0-100) of successful calls in the window, None without data"""
+        with self._lock:
+            latencies = sorted(latency for success, latency in self.window if success)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * q / 100))]
+
+class ModelRouter:
+    """Orders candidate models by health, document size and latency budget"""
+    def __init__(self, models: Sequence[str], window: int = 20, error_threshold: float = 0.5,
+                 min_calls: int = 5, cooldown: float = 30.0):
+        self.models = list(models)
+        self.breakers: Dict[str, CircuitBreaker] = {
+            model: CircuitBreaker(window, error_threshold, min_calls, cooldown) for model in self.models
+        }
+
+    def context_window(self, model: str) -> int:
+        return int(config.get("model_settings").get(model, {}).get("context_window", 8192))
+
+    def route(self, prompt_tokens: int, latency_budget: Optional[float] = None) -> List[str]:
+        """Candidate models in the order they should be tried; open circuits are skipped"""
+        available = [model for model in self.models if self.breakers[model].available()]
+        fitting = [model for model in available if self.context_window(model) >= prompt_tokens]
+        # no model fits: try the largest windows first and let the provider decide
+        candidates = fitting or sorted(available, key=self.context_window, reverse=True)
+        if latency_budget:
+            def within_budget(model):
+                p95 = self.breakers[model].latency_percentile(95)
+                return p95 is None or p95 <= latency_budget
+            candidates = [m for m in candidates if within_budget(m)] + [m for m in candidates if not within_budget(m)]
+        return candidates
+
+    def acquire(self, model: str) -> bool:
+        return self.breakers[model].acquire()
+
+    def release(self, model: str) -> None:
+        self.breakers[model].release()
+
+    def record(self, model: str, success: bool, latency: float) -> None:
+        self.breakers[model].record(success, latency)
+
+    def stats(self) -> Dict[str, Dict]:
+        """Breaker state, error rate and p95 latency per model"""
+        return {
+            model: {"state": b.state, "error_rate": b.error_rate(), "p95_latency": b.latency_percentile(95)}
+            for model, b in self.breakers.items()
+        }
+
+# Routers are shared process-wide so every agent sees the same endpoint health
+_routers: Dict[tuple, ModelRouter] = {}
+_routers_lock = threading.Lock()
+
+def get_model_router(models: Sequence[str], **breaker_settings) -> ModelRouter:
+    """Return the shared router for this model preference order"""
+    with _routers_lock:
+        key = tuple(models)
+        if key not in _routers:
+            _routers[key] = ModelRouter(models, **breaker_settings)
+        return _routers[key]
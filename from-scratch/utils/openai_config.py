@@ -6,5 +6,29 @@ class OpenAIConfig:
         load_dotenv()
         self.api_key = os.getenv('OPENAI_API_KEY')
         self.cost_rate = float(os.getenv('OPENAI_COST_RATE', '0.001'))  # Default cost per token
+        self.base_url = os.getenv('OPENAI_BASE_URL') or None  # OpenAI-compatible endpoint override
+        self.request_timeout = float(os.getenv('OPENAI_REQUEST_TIMEOUT', '60'))  # seconds per request
+        self.max_concurrency = int(os.getenv('OPENAI_MAX_CONCURRENCY', '8'))  # in-flight requests per process
+        # Rate limiting: expected completion size for pre-call token reservations, pause after HTTP 429
+        self.completion_token_estimate = int(os.getenv('OPENAI_COMPLETION_TOKEN_ESTIMATE', '500'))
+        self.rate_limit_pause = float(os.getenv('OPENAI_RATE_LIMIT_PAUSE', '5'))
+        # Map-reduce summarization for documents larger than the model context
+        self.max_input_tokens = int(os.getenv('SUMMARY_MAX_INPUT_TOKENS', '6000'))  # single-call limit
+        self.chunk_tokens = int(os.getenv('SUMMARY_CHUNK_TOKENS', '3000'))
+        self.chunk_overlap = int(os.getenv('SUMMARY_CHUNK_OVERLAP', '200'))
+        self.map_concurrency = int(os.getenv('SUMMARY_MAP_CONCURRENCY', '4'))
+        # Summary cache: bounded in-memory LRU plus an optional SQLite tier shared across processes
+        self.cache_max_bytes = int(os.getenv('SUMMARY_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+        self.cache_ttl = float(os.getenv('SUMMARY_CACHE_TTL', str(7 * 24 * 3600)))
+        self.cache_path = os.getenv('SUMMARY_CACHE_PATH', '.cache/summaries.sqlite3')  # empty disables disk tier
+        # Model routing: skip degraded models via circuit breakers, prefer models within the latency budget
+        self.latency_budget = float(os.getenv('SUMMARY_LATENCY_BUDGET', '0')) or None  # seconds, p95
+        self.circuit_window = int(os.getenv('CIRCUIT_WINDOW', '20'))
+        self.circuit_error_threshold = float(os.getenv('CIRCUIT_ERROR_THRESHOLD', '0.5'))
+        self.circuit_min_calls = int(os.getenv('CIRCUIT_MIN_CALLS', '5'))
+        self.circuit_cooldown = float(os.getenv('CIRCUIT_COOLDOWN', '30'))
+        # Cost accounting: SQLite ledger (empty path disables) and per-document budget (0 = unlimited)
+        self.ledger_path = os.getenv('COST_LEDGER_PATH', '.cache/cost_ledger.sqlite3')
+        self.max_document_cost = float(os.getenv('SUMMARY_MAX_DOCUMENT_COST', '0'))
         if not self.api_key:
             raise ValueError("OPENAI_API_KEY environment variable not set")
@@ -0,0 +1,80 @@
+import asyncio
+import time
+import weakref
+from typing import Dict
+
+from utils.config import config
+
+class TokenBucket:
+    """Continuously refilling bucket; the level may go negative to record debt"""
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.level = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.refill_per_second)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount (capped at capacity) is available"""
+        self._refill()
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.refill_per_second)
+
+    def consume(self, amount: float) -> None:
+        """Take amount from the bucket; a negative amount returns unused capacity"""
+        self._refill()
+        self.level = min(self.capacity, self.level - amount)
+
+class RateLimiter:
+    """Async limiter enforcing requests-per-minute and tokens-per-minute quotas.
+
+    Callers reserve one request plus an estimated token count before calling
+    the provider and reconcile the estimate with the reported usage
+    afterwards. Waiters queue on a FIFO lock, so they are served fairly in
+    arrival order instead of all retrying at once.
+    """
+    def __init__(self, rpm: float, tpm: float):
+        self.requests = TokenBucket(rpm, rpm / 60.0)
+        self.tokens = TokenBucket(tpm, tpm / 60.0)
+        self._lock = asyncio.Lock()
+        self._paused_until = 0.0
+        self.metrics = {"acquired": 0, "waited_seconds": 0.0, "pauses": 0}
+
+    async def acquire(self, estimated_tokens: int) -> None:
+        """Wait until one request and estimated_tokens fit within the quotas, then reserve them"""
+        async with self._lock:
+            start = time.monotonic()
+            while True:
+                wait = max(self.requests.wait_time(1), self.tokens.wait_time(estimated_tokens),
+                           self._paused_until - time.monotonic())
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            self.requests.consume(1)
+            self.tokens.consume(estimated_tokens)
+            self.metrics["acquired"] += 1
+            self.metrics["waited_seconds"] += time.monotonic() - start
+
+    def reconcile(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """Correct a reservation once the provider reported the real token usage"""
+        self.tokens.consume(actual_tokens - estimated_tokens)
+
+    def pause(self, seconds: float) -> None:
+        """Hold back every caller, e.g. after the provider rejected a call with HTTP 429"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self.metrics["pauses"] += 1
+
+# One limiter per model, shared by all agents; keyed by loop because asyncio locks cannot cross loops
+_limiters: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, RateLimiter]]" = weakref.WeakKeyDictionary()
+
+def get_rate_limiter(model: str) -> RateLimiter:
+    """Return the shared limiter for model, configured from config.model_settings"""
+    limiters = _limiters.setdefault(asyncio.get_running_loop(), {})
+    if model not in limiters:
+        settings = config.get("model_settings").get(model, {})
+        limiters[model] = RateLimiter(settings.get("rpm", 500), settings.get("tpm", 30000))
+    return limiters[model]
@@ -0,0 +1,119 @@
+import zipfile
+import xml.etree.ElementTree as ET
+from html.parser import HTMLParser
+from typing import Iterator, List
+
+class HTMLTextExtractor(HTMLParser):
+    """Incremental, event-driven HTML to text converter.
+
+    Feed the document in arbitrary chunks; partial tags and entities that
+    straddle a chunk boundary are buffered by the parser until complete.
+    No DOM is built: text is collected as it is encountered and handed back
+    by drain().
+    """
+    SKIP_TAGS = {"script", "style", "template", "noscript"}
+    BLOCK_TAGS = {
+        "address", "article", "aside", "blockquote", "br", "dd", "div", "dl", "dt",
+        "figcaption", "figure", "footer", "h1", "h2", "h3", "h4", "h5", "h6", "header",
+        "hr", "li", "main", "nav", "ol", "p", "pre", "section", "table", "td", "th",
+        "title", "tr", "ul",
+    }
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._parts: List[str] = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in self.BLOCK_TAGS:
+            self._parts.append("\n")
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in self.BLOCK_TAGS:
+            self._parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in self.BLOCK_TAGS:
+            self._parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self._parts.append(data)
+
+    def drain(self) -> str:
+        """Return the text collected since the previous drain"""
+        text = "".join(self._parts)
+        self._parts.clear()
+        return text
+
+def html_to_text(markup: str) -> str:
+    """Convert a complete HTML string to text"""
+    parser = HTMLTextExtractor()
+    parser.feed(markup)
+    parser.close()
+    return parser.drain()
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+def iter_docx_text(file_path: str) -> Iterator[str]:
+    """Stream paragraph and table text out of a DOCX file.
+
+    ``word/document.xml`` is read straight from the zip archive with
+    iterparse, so the python-docx object model is never built. Paragraphs are
+    yielded as lines, table rows as tab-separated cell text, and processed
+    elements are cleared so memory stays bounded on very large documents.
+    """
+    with zipfile.ZipFile(file_path) as archive, archive.open("word/document.xml") as xml_file:
+        parts: List[str] = []
+        cell_stack: List[List[str]] = []  # paragraph texts of the open table cells
+        row_stack: List[List[str]] = []   # cell texts of the open table rows
+        body = None
+        depth = 0
+        run_depth = 0
+        for event, elem in ET.iterparse(xml_file, events=("start", "end")):
+            tag = elem.tag
+            if event == "start":
+                depth += 1
+                if depth == 2:
+                    body = elem
+                elif tag == f"{_W}r":
+                    run_depth += 1
+                elif tag == f"{_W}tr":
+                    row_stack.append([])
+                elif tag == f"{_W}tc":
+                    cell_stack.append([])
+                continue
+
+            if tag == f"{_W}r":
+                run_depth -= 1
+            elif run_depth and tag == f"{_W}t":
+                parts.append(elem.text or "")
+            elif run_depth and tag == f"{_W}tab":
+                parts.append("\t")
+            elif run_depth and tag in (f"{_W}br", f"{_W}cr"):
+                parts.append("\n")
+            elif tag == f"{_W}p":
+                text = "".join(parts)
+                parts.clear()
+                elem.clear()
+                if cell_stack:
+                    cell_stack[-1].append(text)
+                else:
+                    yield text + "\n"
+            elif tag == f"{_W}tc":
+                row_stack[-1].append(" ".join(p for p in cell_stack.pop() if p))
+            elif tag == f"{_W}tr":
+                row_text = "\t".join(row_stack.pop())
+                elem.clear()
+                if cell_stack:
+                    cell_stack[-1].append(row_text)
+                else:
+                    yield row_text + "\n"
+            if depth == 3 and body is not None:
+                # Top-level block finished: drop everything parsed so far
+                body.clear()
+            depth -= 1
@@ -0,0 +1,53 @@
+from functools import lru_cache
+from typing import List
+
+try:
+    import tiktoken
+except ImportError:  # optional: fall back to a character-based estimate
+    tiktoken = None
+
+CHARS_PER_TOKEN = 4  # rough average for English text with OpenAI tokenizers
+
+@lru_cache()
+def _encoding(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # encoding files could not be loaded (e.g. offline); use the estimate instead
+        return None
+
+def count_tokens(text: str, model: str = "gpt-4") -> int:
+    """Count (or estimate, without tiktoken) the tokens in text"""
+    encoding = _encoding(model)
+    if encoding is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
+
+def chunk_text(text: str, max_tokens: int, overlap: int = 0, model: str = "gpt-4") -> List[str]:
+    """Split text into chunks of at most max_tokens, each sharing overlap tokens with its predecessor"""
+    if max_tokens <= overlap:
+        raise ValueError("max_tokens must be greater than overlap")
+    encoding = _encoding(model)
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        step = max_tokens - overlap
+        return [encoding.decode(tokens[start:start + max_tokens])
+                for start in range(0, max(len(tokens) - overlap, 1), step)]
+
+    size, step = max_tokens * CHARS_PER_TOKEN, (max_tokens - overlap) * CHARS_PER_TOKEN
+    chunks, start = [], 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            # prefer to cut on whitespace within the last quarter of the window
+            cut = text.rfind(" ", start + size * 3 // 4, end)
+            end = cut if cut > 0 else end
+        chunks.append(text[start:end])
+        if end == len(text):
+            break
+        start = max(end - (size - step), start + 1)
+    return chunks